@@ -0,0 +1,701 @@
+#Benchmarks for engine hot paths
+#Usage: python3 bench.py [--json FILE] [benchmark names...]
+#With no benchmark names, all of them are run. Every benchmark uses fixed seeds, so runs are comparable from commit to
+#commit. With --json, the results are also written to FILE ("-" for stdout) as JSON, for tracking regressions.
+import random, time, sys, json, platform, subprocess
+from types import SimpleNamespace
+from collections import defaultdict, deque
+
+from board import Board, pathfind, distance_map
+from entity import Entity
+from fov import shadowcast
+from scheduler import Scheduler
+from rng import RandomStreams
+
+results = {} #Benchmark result name -> metrics
+
+def report(name, text, **metrics):
+	"Prints a benchmark result, and records its metrics for the JSON output"
+	print(f"{name}: {text}")
+	results[name] = metrics
+
+def make_level(cols=40, rows=16, seed=0):
+	"Generates a board with a player placed on it, without needing a screen"
+	random.seed(seed)
+	RandomStreams(seed).activate()
+	g = SimpleNamespace()
+	g.player = Entity(g)
+	g.board = Board(g, cols, rows)
+	g.board.generate()
+	g.player.place_randomly()
+	return g
+
+def floor_cells(board):
+	return [(x, y) for y in range(board.rows) for x in range(board.cols) if board.walkable[x + y * board.cols]]
+
+def timed(func, *args, repeat=1):
+	"Returns the average time per call in seconds"
+	start = time.perf_counter()
+	for _ in range(repeat):
+		func(*args)
+	return (time.perf_counter() - start) / repeat
+
+def bench_generate(seeds=range(10), sizes=((40, 16), (120, 50))):
+	"Generating a level with Board.generate"
+	for cols, rows in sizes:
+		total = 0
+		for seed in seeds:
+			random.seed(seed)
+			RandomStreams(seed).activate()
+			board = Board(SimpleNamespace(), cols, rows)
+			total += timed(board.generate)
+		n = len(seeds)
+		report(f"generate/{cols}x{rows}", f"{total/n*1e3:.2f} ms per level", ms_per_level=total/n*1e3)
+
+def bench_fov(seeds=range(10), samples=20):
+	totals = {"raycast": 0, "shadowcast": 0}
+	calls = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		player = g.player
+		cells = floor_cells(g.board)
+		random.shuffle(cells)
+		for x, y in cells[:samples]:
+			player.x, player.y = x, y
+			for alg in totals:
+				player.fov_algorithm = alg
+				totals[alg] += timed(player.calc_fov)
+			calls += 1
+	for alg, total in totals.items():
+		report(f"fov/{alg}", f"{total/calls*1e6:.1f} us per call ({calls} calls)", us_per_call=total/calls*1e6, calls=calls)
+	report("fov/speedup", f"{totals['raycast']/totals['shadowcast']:.1f}x", ratio=totals['raycast']/totals['shadowcast'])
+
+def bench_fov_walk(seeds=range(10), trips=4):
+	"Walks back and forth between two distant points, as the player often does when exploring and fighting"
+	cached = uncached = 0
+	moves = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		player = g.player
+		cells = floor_cells(g.board)
+		start = max(cells, key=lambda c: abs(c[0] - player.x) + abs(c[1] - player.y))
+		path = pathfind(g.board, (player.x, player.y), start)
+		route = (path + path[::-1]) * trips
+		for x, y in route:
+			player.x, player.y = x, y
+			cached += timed(player.calc_fov)
+			uncached += timed(shadowcast, g.board, x, y)
+			moves += 1
+	report("fov_walk/uncached", f"{uncached/moves*1e6:.1f} us per move ({moves} moves)", us_per_move=uncached/moves*1e6, moves=moves)
+	report("fov_walk/cached", f"{cached/moves*1e6:.1f} us per move", us_per_move=cached/moves*1e6, moves=moves)
+
+def bench_fov_forward(seeds=range(10)):
+	"Walks once between two distant points without turning back, so the viewer never stands in the same place twice"
+	cached = uncached = 0
+	moves = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		player = g.player
+		cells = floor_cells(g.board)
+		start = max(cells, key=lambda c: abs(c[0] - player.x) + abs(c[1] - player.y))
+		for x, y in pathfind(g.board, (player.x, player.y), start):
+			player.x, player.y = x, y
+			cached += timed(player.calc_fov)
+			uncached += timed(shadowcast, g.board, x, y)
+			moves += 1
+	report("fov_forward/uncached", f"{uncached/moves*1e6:.1f} us per move ({moves} moves)", us_per_move=uncached/moves*1e6, moves=moves)
+	report("fov_forward/cached", f"{cached/moves*1e6:.1f} us per move", us_per_move=cached/moves*1e6, moves=moves)
+
+def bench_los(seeds=range(10), turns=200, monsters=10):
+	"Line of sight checks between a handful of monsters and the player, as done by Monster.sees_target every turn"
+	def uncached(board, pos1, pos2):
+		for x, y in board.line_between(pos1, pos2, skiplast=True):
+			if board.blocks_sight(x, y):
+				return False
+		return True
+	def run(board, check, workload):
+		for mons, player in workload:
+			for m in mons:
+				check(m, player)
+				check(player, m)
+	cached_time = uncached_time = 0
+	hits = misses = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		board = g.board
+		cells = floor_cells(board)
+		mons = random.sample(cells, monsters)
+		player = random.choice(cells)
+		workload = []
+		for _ in range(turns):
+			#Everyone drifts around a little, so some lines repeat and some don't
+			if random.random() < 0.3:
+				player = random.choice(cells)
+			if random.random() < 0.3:
+				mons[random.randrange(monsters)] = random.choice(cells)
+			workload.append((mons[:], player))
+		cached_time += timed(run, board, board.line_of_sight, workload)
+		uncached_time += timed(run, board, lambda a, b: uncached(board, a, b), workload)
+		hits += board.los_hits
+		misses += board.los_misses
+	calls = len(seeds) * turns * monsters * 2
+	report("los/uncached", f"{uncached_time/calls*1e6:.2f} us per call ({calls} calls)", us_per_call=uncached_time/calls*1e6, calls=calls)
+	report("los/cached", f"{cached_time/calls*1e6:.2f} us per call, hit rate {hits/(hits+misses):.0%}",
+		us_per_call=cached_time/calls*1e6, calls=calls, hit_rate=hits/(hits+misses))
+
+def bench_line(seeds=range(10), queries=1000):
+	"Board.line_between between random pairs of cells, going through the whole line"
+	total = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		board = g.board
+		cells = floor_cells(board)
+		pairs = [(random.choice(cells), random.choice(cells)) for _ in range(queries)]
+		def run():
+			for a, b in pairs:
+				deque(board.line_between(a, b), maxlen=0) #line_between is a generator, so it does nothing until iterated over
+		total += timed(run)
+	calls = len(seeds) * queries
+	report("line", f"{total/calls*1e6:.2f} us per call ({calls} calls)", us_per_call=total/calls*1e6, calls=calls)
+
+#Baseline pathfinding implementation
+class OpenSet:
+	
+	def __init__(self, key=None):
+		self._data = []
+		self._dup = set()
+		self.key = key or (lambda v: v)
+		
+	def add(self, value):
+		if value in self._dup:
+			return
+		self._dup.add(value)
+		a = self._data
+		key = self.key
+		i = len(a)
+		a.append(value)
+		while i > 0:
+			parent = i // 2
+			if key(a[parent]) < key(a[i]):
+				break
+			a[parent], a[i] = a[i], a[parent]
+			i = parent
+			
+	def pop(self):
+		if len(self._data) == 0:
+			raise IndexError("pop from an empty heap")
+		a = self._data
+		val = a[0]
+		a[0] = a[-1]
+		a.pop()
+		key = self.key
+		i = 0
+		while True:
+			left = 2 * i + 1
+			right = 2 * i + 2
+			if left >= len(a):
+				break
+			node = left
+			if right < len(a) and key(a[right]) < key(a[left]):
+				node = right
+			if key(a[i]) > key(a[node]):
+				a[i], a[node] = a[node], a[i]
+				i = node
+			else:
+				break
+		self._dup.remove(val)
+		return val
+		
+	def __contains__(self, value):
+		return value in self._dup
+		
+	def __bool__(self):
+		return len(self._data) > 0
+		
+def legacy_pathfind(board, start, end, *, rand=False):
+	"The A* implementation that board.pathfind replaced, kept as a baseline"
+	def h(a, b):
+		return abs(a[0] - b[0]) + abs(a[1] - b[1])
+	gScore = defaultdict(lambda: float("inf"))
+	gScore[start] = 0
+	fScore = defaultdict(lambda: float("inf"))
+	fScore[start] = h(start, end)
+	open_set = OpenSet(fScore.__getitem__)
+	open_set.add(start)
+	came_from = {}
+	rows = board.rows
+	cols = board.cols
+	walkable = board.walkable
+	mons_cache = board.mons_cache
+	def can_pass(x, y):
+		if not walkable[x + y * cols]:
+			return False
+		return (x, y) == end or not mons_cache[y][x]
+	while open_set:
+		curr = open_set.pop()
+		if curr == end:
+			path = [curr]
+			while curr in came_from:
+				curr = came_from[curr]
+				path.append(curr)
+			path.reverse()
+			return path
+		neighbors = []
+		x, y = curr
+		if x + 1 < cols and can_pass(x + 1, y): 
+			neighbors.append((x + 1, y))
+		if x - 1 >= 0 and can_pass(x - 1, y): 
+			neighbors.append((x - 1, y))
+		if y + 1 < rows and can_pass(x, y + 1): 
+			neighbors.append((x, y + 1))
+		if y - 1 >= 0 and can_pass(x, y - 1):
+			neighbors.append((x, y - 1))
+		if rand:
+			random.shuffle(neighbors)
+		
+		for n in neighbors:
+			cost = 1
+			t = gScore[curr] + cost
+			if t < gScore[n]:
+				came_from[n] = curr
+				gScore[n] = t
+				fScore[n] = t + h(n, end)
+				
+				if n not in open_set:
+					open_set.add(n)
+	return []
+
+def bench_pathfind(seeds=range(10), queries=100):
+	new_time = old_time = 0
+	for seed in seeds:
+		g = make_level(seed=seed)
+		board = g.board
+		cells = floor_cells(board)
+		pairs = [(random.choice(cells), random.choice(cells)) for _ in range(queries)]
+		for start, end in pairs:
+			new = pathfind(board, start, end)
+			old = legacy_pathfind(board, start, end)
+			#The old open set's heap could misorder entries, so it sometimes returned longer paths than necessary
+			assert bool(new) == bool(old) and len(new) <= len(old), "Paths differ"
+			new_time += timed(pathfind, board, start, end, repeat=3)
+			old_time += timed(legacy_pathfind, board, start, end, repeat=3)
+	calls = len(seeds) * queries
+	report("pathfind/legacy", f"{old_time/calls*1e6:.1f} us per call ({calls} calls)", us_per_call=old_time/calls*1e6, calls=calls)
+	report("pathfind/heapq", f"{new_time/calls*1e6:.1f} us per call", us_per_call=new_time/calls*1e6, calls=calls)
+	report("pathfind/speedup", f"{old_time/new_time:.1f}x", ratio=old_time/new_time)
+
+def bench_approach(seeds=range(3), monsters=60, cols=120, rows=50):
+	"Every monster moving towards the player: one A* search each vs one shared distance map"
+	a_star = shared = 0
+	for seed in seeds:
+		g = make_level(cols, rows, seed=seed)
+		board = g.board
+		player = g.player
+		cells = [c for c in floor_cells(board) if c != (player.x, player.y)]
+		mons = []
+		for x, y in random.sample(cells, min(monsters, len(cells))):
+			m = Entity(g)
+			m.place_at(x, y)
+			mons.append(m)
+		target = (player.x, player.y)
+		def per_monster():
+			for m in mons:
+				pathfind(board, (m.x, m.y), target, rand=True)
+		def with_map():
+			dist = distance_map(board, target)
+			for m in mons:
+				here = dist.get(m.x + m.y * cols, -1)
+				steps = [(x, y) for x, y in [(m.x+1, m.y), (m.x-1, m.y), (m.x, m.y+1), (m.x, m.y-1)] if 0 <= dist.get(x + y * cols, -1) < here and board.is_passable(x, y)]
+				if steps:
+					random.choice(steps)
+		a_star += timed(per_monster)
+		shared += timed(with_map)
+	n = len(seeds)
+	report("approach/a_star", f"{a_star/n*1e3:.2f} ms per turn ({monsters} monsters, {cols}x{rows})", ms_per_turn=a_star/n*1e3, monsters=monsters)
+	report("approach/shared_map", f"{shared/n*1e3:.2f} ms per turn", ms_per_turn=shared/n*1e3, monsters=monsters)
+
+def bench_chase(seeds=range(10), chasers=4, turns=150):
+	"Monsters following a moving target with path_towards, with and without reusing cached paths"
+	import entity
+	results = {}
+	for reuse in (False, True):
+		total = 0
+		stats = dict.fromkeys(entity.path_stats, 0)
+		for seed in seeds:
+			g = make_level(seed=seed)
+			board = g.board
+			cells = floor_cells(board)
+			target = g.player
+			mons = []
+			for x, y in random.sample([c for c in cells if c != (target.x, target.y)], chasers):
+				m = Entity(g)
+				m.place_at(x, y)
+				mons.append(m)
+			for k in entity.path_stats:
+				entity.path_stats[k] = 0
+			heading = [(1, 0)]
+			def turn():
+				#The target explores by walking in one direction until it hits something
+				if not target.move(*heading[0]):
+					dirs = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+					random.shuffle(dirs)
+					for d in dirs:
+						if target.move(*d):
+							heading[0] = d
+							break
+				for m in mons:
+					if m.distance(target) <= 1:
+						continue #A monster would attack here instead of moving
+					if not reuse:
+						m.clear_path()
+					m.path_towards(target.x, target.y)
+			for _ in range(turns):
+				total += timed(turn)
+			for k, v in entity.path_stats.items():
+				stats[k] += v
+		results[reuse] = total
+		name = "reuse" if reuse else "replan_always"
+		calls = len(seeds) * turns * chasers
+		report(f"chase/{name}", f"{total/calls*1e6:.1f} us per path_towards call, {stats}", us_per_call=total/calls*1e6, **stats)
+
+def bench_route(seeds=range(3), queries=50, cols=250, rows=250):
+	"Long paths: a full A* search vs planning over the room graph and searching only the next leg, as path_towards does"
+	import entity
+	full = hierarchical = 0
+	full_steps = route_steps = calls = 0
+	for seed in seeds:
+		g = make_level(cols, rows, seed=seed)
+		board = g.board
+		board.clear_cache() #Nothing in the way but the terrain
+		graph = board.room_graph()
+		cells = floor_cells(board)
+		pairs = []
+		while len(pairs) < queries:
+			start, end = random.choice(cells), random.choice(cells)
+			if abs(start[0] - end[0]) + abs(start[1] - end[1]) > entity.LONG_PATH:
+				pairs.append((start, end))
+		mover = Entity(g)
+		def leg(start, end):
+			mover.x, mover.y = start
+			goal = mover._route_leg(*end)
+			return goal and pathfind(board, start, goal)
+		for start, end in pairs:
+			path = pathfind(board, start, end)
+			full += timed(pathfind, board, start, end)
+			hierarchical += timed(leg, start, end)
+			calls += 1
+			if not path:
+				continue
+			#Follow the route leg by leg to the end, to compare its length with the shortest path
+			pos = start
+			steps = 0
+			while pos != end:
+				step = leg(pos, end)
+				steps += len(step) - 1
+				pos = step[-1]
+			full_steps += len(path) - 1
+			route_steps += steps
+	report("route/full_a_star", f"{full/calls*1e3:.2f} ms per path ({calls} paths, {cols}x{rows}, {len(graph.rooms)} rooms, {len(graph.corridors)} corridors)",
+		ms_per_path=full/calls*1e3, paths=calls)
+	report("route/room_graph", f"{hierarchical/calls*1e3:.2f} ms per path for the route and its next leg, routes {route_steps/full_steps:.2f}x as long as the shortest path",
+		ms_per_path=hierarchical/calls*1e3, length_ratio=route_steps/full_steps)
+	report("route/speedup", f"{full/hierarchical:.1f}x", ratio=full/hierarchical)
+
+def legacy_place_randomly(entity):
+	"How Entity.place_randomly found a spot before the board kept an index of free cells, kept as a baseline"
+	board = entity.g.board
+	for _ in range(200):
+		x = random.randint(1, board.cols - 2)
+		y = random.randint(1, board.rows - 2)
+		if entity.can_place(x, y):
+			return (x, y)
+	cells = [(x, y) for y in range(1, board.rows - 1) for x in range(1, board.cols - 1)]
+	random.shuffle(cells)
+	for x, y in cells:
+		if entity.can_place(x, y):
+			return (x, y)
+	return None
+
+def bench_place(seeds=range(3), sizes=((40, 16), (250, 250)), monsters=50):
+	"Placing monsters at random: rejection sampling vs the free cell index, on a board that fills up as they're placed"
+	for cols, rows in sizes:
+		times = {"legacy": [], "index": []}
+		for seed in seeds:
+			for name in times:
+				g = make_level(cols, rows, seed=seed)
+				for _ in range(monsters):
+					m = Entity(g)
+					start = time.perf_counter()
+					if name == "legacy":
+						pos = legacy_place_randomly(m)
+						if pos:
+							m.place_at(*pos)
+					else:
+						m.place_randomly()
+					times[name].append(time.perf_counter() - start)
+		for name, t in times.items():
+			report(f"place/{name}/{cols}x{rows}", f"{sum(t)/len(t)*1e6:.1f} us per placement, worst {max(t)*1e6:.0f} us ({len(t)} placements)",
+				us_per_placement=sum(t)/len(t)*1e6, worst_us=max(t)*1e6, placements=len(t))
+
+def bench_schedule(counts=(10, 100, 1000), ticks=200):
+	"Working out the monster turn order for a tick: shuffle and sort vs the speed-bucketed scheduler"
+	class Actor:
+		def __init__(self, speed):
+			self.speed = speed
+		def get_speed(self):
+			return self.speed
+	for n in counts:
+		actors = [Actor(random.choice([20, 30, 30, 30, 40, 60])) for _ in range(n)]
+		sched = Scheduler()
+		for a in actors:
+			sched.add(a)
+		def old():
+			order = actors[:]
+			random.shuffle(order)
+			order.sort(key=lambda m: m.get_speed(), reverse=True)
+		old_time = timed(old, repeat=ticks)
+		new_time = timed(sched.turn_order, repeat=ticks)
+		report(f"schedule/{n}", f"sort {old_time*1e6:.1f} us, scheduler {new_time*1e6:.1f} us per tick",
+			sort_us_per_tick=old_time*1e6, scheduler_us_per_tick=new_time*1e6)
+
+def bench_game_turns(seeds=range(3), turns=2000):
+	"Whole game turns on a real level, run headless with the player waiting in place"
+	from gameobj import Game
+	total = 0
+	for seed in seeds:
+		random.seed(seed)
+		g = Game(headless=True)
+		g.generate_level()
+		player = g.player
+		player.HP = 10**9 #Keep the player alive for the whole run
+		def run():
+			for _ in range(turns):
+				player.energy = 0
+				g.do_turn()
+		total += timed(run)
+	calls = len(seeds) * turns
+	report("game_turns", f"{total/calls*1e6:.1f} us per turn ({calls} turns, {len(g.monsters)} monsters, {len(g.scheduler.dormant)} dormant)",
+		us_per_turn=total/calls*1e6, turns=calls)
+
+def bench_monsters(counts=(10, 30, 60), seeds=range(3), turns=300):
+	"Whole game turns with a given number of monsters on the level, all of them awake"
+	from gameobj import Game
+	for count in counts:
+		total = placed = 0
+		for seed in seeds:
+			random.seed(seed)
+			g = Game(headless=True, seed=seed)
+			g.generate_level()
+			player = g.player
+			player.HP = 10**9
+			pool = [t for t in g.mon_types if t.min_level <= 1]
+			for _ in range(count * 4):
+				if len(g.monsters) >= count:
+					break
+				g.place_monster(random.choice(pool))
+			for m in g.monsters:
+				m.is_aware = True
+			placed += len(g.monsters)
+			def run():
+				for _ in range(turns):
+					player.energy = 0
+					g.do_turn()
+			total += timed(run)
+		calls = len(seeds) * turns
+		placed /= len(seeds)
+		report(f"monsters/{count}", f"{total/calls*1e6:.1f} us per turn ({placed:.0f} monsters placed)",
+			us_per_turn=total/calls*1e6, turns=calls, monsters=placed)
+
+def bench_render(seeds=range(3), moves=300):
+	"Redrawing the screen as the player walks around: full redraws vs only writing the cells that changed"
+	from gameobj import Game
+	results = {}
+	for full in (True, False):
+		total = cells = 0
+		for seed in seeds:
+			random.seed(seed)
+			g = Game(headless=True)
+			g.generate_level()
+			player = g.player
+			renderer = g.renderer
+			renderer.invalidate()
+			renderer.cells_written = 0
+			def run():
+				for _ in range(moves):
+					player.move(*random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)]))
+					if full:
+						renderer.invalidate()
+					g.draw_board()
+			total += timed(run)
+			cells += renderer.cells_written
+		name = "full" if full else "incremental"
+		frames = len(seeds) * moves
+		report(f"render/{name}", f"{total/frames*1e6:.1f} us per frame, {cells/frames:.0f} cells written per frame",
+			us_per_frame=total/frames*1e6, cells_per_frame=cells/frames)
+
+def bench_save(seeds=range(3), turns=500, repeat=20):
+	"Saving and loading a game part way through a level: the save format vs pickling the whole game"
+	import pickle
+	from gameobj import Game
+	from savefile import encode_game, decode_game
+	times = defaultdict(float)
+	sizes = defaultdict(int)
+	for seed in seeds:
+		random.seed(seed)
+		g = Game(headless=True)
+		g.generate_level()
+		player = g.player
+		player.HP = 10**9
+		for _ in range(turns):
+			player.energy = 0
+			g.do_turn()
+		data = encode_game(g)
+		pickled = pickle.dumps(g, pickle.HIGHEST_PROTOCOL)
+		sizes["format"] += len(data)
+		sizes["pickle"] += len(pickled)
+		times["format/save"] += timed(encode_game, g, repeat=repeat)
+		times["pickle/save"] += timed(pickle.dumps, g, pickle.HIGHEST_PROTOCOL, repeat=repeat)
+		times["format/load"] += timed(decode_game, g, data, repeat=repeat)
+		times["pickle/load"] += timed(pickle.loads, pickled, repeat=repeat)
+	n = len(seeds)
+	for name in ("pickle", "format"):
+		save, load = times[name + "/save"]/n*1e3, times[name + "/load"]/n*1e3
+		report(f"save/{name}", f"save {save:.2f} ms, load {load:.2f} ms, {sizes[name]//n} bytes", save_ms=save, load_ms=load, bytes=sizes[name]//n)
+	
+def bench_save_files(seeds=range(3), turns=500, repeat=10):
+	"Game.save_game and Game.load_game round trips through the disk, including fsync"
+	import os, tempfile
+	from gameobj import Game
+	save_dir = tempfile.mkdtemp()
+	save = load = size = 0
+	for seed in seeds:
+		random.seed(seed)
+		g = Game(headless=True, seed=seed, save_path=os.path.join(save_dir, "save.dat"))
+		g.generate_level()
+		player = g.player
+		player.HP = 10**9
+		for _ in range(turns):
+			player.energy = 0
+			g.do_turn()
+		def full_save():
+			g.journal.reset() #Time full saves rather than journal appends
+			g.save_game(True)
+		save += timed(full_save, repeat=repeat)
+		size += os.path.getsize(g.save_path)
+		load += timed(g.load_game, repeat=repeat)
+		g.delete_saved_game()
+	os.rmdir(save_dir)
+	n = len(seeds)
+	report("save_files", f"save {save/n*1e3:.2f} ms, load {load/n*1e3:.2f} ms, {size//n} bytes",
+		save_ms=save/n*1e3, load_ms=load/n*1e3, bytes=size//n)
+
+def bench_journal(seeds=range(3), turns=1000, every=5):
+	"Bytes written per autosave during play, with full saves vs journalled delta saves"
+	from gameobj import Game
+	from savefile import SaveJournal, encode_game
+	full = written = saves = 0
+	for seed in seeds:
+		random.seed(seed)
+		g = Game(headless=True)
+		g.generate_level()
+		player = g.player
+		player.HP = 10**9
+		journal = SaveJournal()
+		for turn in range(turns):
+			player.move(*random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)]))
+			player.energy = 0
+			g.do_turn()
+			if turn % every == 0:
+				full += len(encode_game(g))
+				written += sum(len(data) for _, data, _ in journal.save(g, "save.dat"))
+				saves += 1
+	report("journal/full", f"{full/saves:.0f} bytes per save ({saves} saves)", bytes_per_save=full/saves, saves=saves)
+	report("journal/delta", f"{written/saves:.0f} bytes per save, including compactions", bytes_per_save=written/saves, saves=saves)
+
+def bench_replay(seeds=range(3), keys=2000):
+	"Recording a headless game played with random moves, then replaying it at full speed and checking it plays out the same"
+	import os, tempfile
+	from gameobj import Game
+	from headless import ScriptExhausted
+	from replay import replay, start_game, start_recording, state_digest
+	from roguelike import play
+	path = os.path.join(tempfile.mkdtemp(), "bench.rec")
+	for seed in seeds:
+		random.seed(seed)
+		script = [random.choice("wasd") for _ in range(keys)]
+		g = Game(headless=True, keys=script, save_path=path + ".save", seed=seed)
+		start_game(g)
+		recorder = start_recording(g, path)
+		start = time.perf_counter()
+		try:
+			play(g)
+		except ScriptExhausted:
+			pass
+		recorded = time.perf_counter() - start
+		recorder.close()
+		g.saver.flush()
+		g.delete_saved_game()
+		expected = state_digest(g)
+		result = replay(path)
+		size = os.path.getsize(path)
+		matches = result["digest"] == expected and not result["divergences"]
+		report(f"replay/seed_{seed}", f"{result['keys']} keys, {result['turns']} turns, {size} bytes recorded, "
+			f"played in {recorded:.3f}s, replayed in {result['seconds']:.3f}s{'' if matches else ', MISMATCH'}",
+			keys=result["keys"], turns=result["turns"], bytes=size, play_s=recorded, replay_s=result["seconds"], matches=matches)
+	os.remove(path)
+	os.rmdir(os.path.dirname(path))
+
+BENCHMARKS = {
+	"generate": bench_generate,
+	"fov": bench_fov,
+	"fov_walk": bench_fov_walk,
+	"fov_forward": bench_fov_forward,
+	"los": bench_los,
+	"line": bench_line,
+	"pathfind": bench_pathfind,
+	"approach": bench_approach,
+	"chase": bench_chase,
+	"route": bench_route,
+	"place": bench_place,
+	"schedule": bench_schedule,
+	"game_turns": bench_game_turns,
+	"monsters": bench_monsters,
+	"render": bench_render,
+	"save": bench_save,
+	"save_files": bench_save_files,
+	"journal": bench_journal,
+	"replay": bench_replay,
+}
+
+def environment():
+	"Describes what the benchmarks were run on"
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		"commit": commit,
+		"python": platform.python_version(),
+		"implementation": platform.python_implementation(),
+		"platform": platform.platform(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+	}
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="Benchmarks for engine hot paths")
+	parser.add_argument("names", nargs="*", metavar="name", help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+	parser.add_argument("--json", metavar="FILE", help="also write the results to FILE as JSON (- for stdout)")
+	args = parser.parse_args()
+	for name in args.names:
+		if name not in BENCHMARKS:
+			parser.error(f"unknown benchmark: {name}")
+	for name in args.names or BENCHMARKS:
+		BENCHMARKS[name]()
+	if args.json:
+		out = json.dumps({"environment": environment(), "results": results}, indent=1)
+		if args.json == "-":
+			print(out)
+		else:
+			with open(args.json, "w") as f:
+				f.write(out + "\n")
@@ -1,28 +1,265 @@
-import random, math
+import math
+from array import array
+from rng import random
 from utils import *
+from roomgraph import RoomGraph
 
-class Tile:
+class Terrain:
+	"""
+	A kind of terrain. Cells only store the index of their terrain in TERRAIN, so everything about a kind of terrain
+	lives here, once, rather than on every cell.
+	"""
+	__slots__ = ("index", "name", "passable", "symbol", "stair")
 	
-	def __init__(self, passable, symbol, stair=False):
-		self.passable = passable
+	def __init__(self, name, passable, symbol, stair=False):
 		assert len(symbol) == 1, "Symbol must be exactly one character"
+		self.index = len(TERRAIN)
+		self.name = name
+		self.passable = passable
 		self.symbol = symbol
-		self.revealed = False
-		self.walked = False
 		self.stair = stair
-		self.items = []
+		TERRAIN.append(self)
+		TERRAIN_BY_NAME[name] = self
+		
+	def __repr__(self):
+		return f"<Terrain {self.name}>"
+		
+	def __reduce__(self):
+		return (terrain_named, (self.name,))
+		
+TERRAIN = [] #Indexed by Terrain.index; a board's terrain grid holds these indices
+TERRAIN_BY_NAME = {}
+
+def terrain_named(name):
+	return TERRAIN_BY_NAME[name]
+
+WALL = Terrain("wall", False, "#")
+FLOOR = Terrain("floor", True, " ")
+STAIR = Terrain("stair", True, ">", stair=True)
+
+#Translation tables from a terrain index to the value of the packed grids (see below), for use with bytes.translate
+OPAQUE_TABLE = bytes(not t.passable for t in TERRAIN).ljust(256, b"\0")
+WALKABLE_TABLE = bytes(t.passable for t in TERRAIN).ljust(256, b"\0")
+
+class Tile:
+	"Boards used to keep a Tile for every cell. Only kept so that boards pickled back then can still be loaded."
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.__dict__.setdefault("stair", False)
+		
+_every_cell = {} #Board size -> array of every cell index, since building one from a range is slow
 
+class CellSet:
+	"""
+	A set of cells of a board (as indices y*cols + x) that can also pick one of its cells at random in constant time.
+	The cells are kept in an array, along with where in that array each cell of the board is (or -1 if it isn't in the set).
+	"""
+	__slots__ = ("cells", "positions")
+	
+	def __init__(self, size, cells=()):
+		self.cells = array("i", cells)
+		positions = self.positions = array("i", [-1]) * size
+		for i, cell in enumerate(self.cells):
+			positions[cell] = i
+		
+	@classmethod
+	def every(cls, size):
+		"Returns a set of every cell, which is a lot quicker than filling one in cell by cell"
+		every = _every_cell.get(size)
+		if every is None:
+			every = _every_cell[size] = array("i", range(size))
+		cellset = cls(0)
+		cellset.cells = every[:]
+		cellset.positions = every[:]
+		return cellset
+		
+	def __len__(self):
+		return len(self.cells)
+		
+	def __contains__(self, cell):
+		return self.positions[cell] >= 0
+		
+	def add(self, cell):
+		if self.positions[cell] < 0:
+			self.positions[cell] = len(self.cells)
+			self.cells.append(cell)
+			
+	def discard(self, cell):
+		positions = self.positions
+		i = positions[cell]
+		if i < 0:
+			return
+		positions[cell] = -1
+		last = self.cells.pop()
+		if last != cell: #Move the last cell into the gap
+			self.cells[i] = last
+			positions[last] = i
+			
+	def choice(self):
+		return random.choice(self.cells)
+		
 class Board:
 	
 	def __init__(self, g, cols, rows):
 		self.g = g
 		self.cols = cols
 		self.rows = rows
-		self.data = [[Tile(True, " ") for x in range(cols)] for y in range(rows)]
-		self.clear_cache()
+		self.revision = 0 #Incremented whenever the terrain changes, so that anything derived from it knows when to recalculate
+		self.fill(FLOOR)
+		self.clear_los_cache()
+		self.los_hits = 0
+		self.los_misses = 0
+		self.path_scratch = None
+		self.room_graph_cache = None
+		
+	def __getstate__(self):
+		d = self.__dict__.copy()
+		del d["los_cache"]
+		d.pop("los_cells", None)
+		d.pop("redraw", None)
+		d["path_scratch"] = None
+		d["room_graph_cache"] = None
+		for name in ("occupied", "free_cells", "empty_cells"): #Worked out again from the rest of the board
+			d.pop(name, None)
+		return d
+		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.__dict__.setdefault("revision", 0)
+		self.__dict__.setdefault("los_hits", 0)
+		self.__dict__.setdefault("los_misses", 0)
+		self.__dict__.setdefault("path_scratch", None)
+		self.__dict__.setdefault("rooms", [])
+		self.__dict__.setdefault("room_graph_cache", None)
+		self.redraw = None
+		self.clear_los_cache()
+		if "data" in state: #Saved back when every cell had a Tile, which also tracked whether it was revealed
+			rows = self.__dict__.pop("data")
+			revealed = state.get("revealed")
+			if revealed is None:
+				revealed = bytearray(tile.__dict__.get("revealed", False) for row in rows for tile in row)
+			self.fill(FLOOR)
+			for y, row in enumerate(rows):
+				for x, tile in enumerate(row):
+					if tile.stair:
+						terrain = STAIR
+					else:
+						terrain = FLOOR if tile.passable else WALL
+					index = x + y * self.cols
+					self.terrain[index] = terrain.index
+					if tile.walked:
+						self.walked.add(index)
+					if tile.items:
+						self.items[index] = list(tile.items)
+			self.rebuild_grids()
+			self.revealed = revealed
+		if "walkable" not in self.__dict__:
+			self.rebuild_grids()
+		if "mons_cache" not in self.__dict__:
+			self.mons_cache = [[None] * self.cols for _ in range(self.rows)]
+		self.index_cells()
+			
+	#The terrain of each cell is kept in a grid of terrain indices, one byte per cell and indexed by y*cols + x.
+	#Anything else about a cell is rare, so it's kept in sparse tables keyed by the same index: the items lying there,
+	#and which cells the player has walked on. Memory thus grows with the number of cells that have something going on,
+	#rather than with the size of the board.
+	#This replaced chunks of cells that shared Tile objects until one was written to. With a cell down to one byte,
+	#there is nothing left for chunks to share, and every read would still have to go through the chunk table.
+	
+	def fill(self, terrain):
+		"Sets every cell to the given terrain, and clears everything else about them"
+		size = self.cols * self.rows
+		self.terrain = bytearray([terrain.index]) * size
+		self.items = {}
+		self.walked = set()
+		self.revealed = bytearray(size)
+		self.rooms = [] #(x, y, width, height) of each room placed by generate
+		self.redraw = None #Indices of the cells whose terrain or items changed since the screen was drawn; None if all of them might have
+		self.mons_cache = [[None] * self.cols for _ in range(self.rows)]
+		self.rebuild_grids()
+		#Nothing is on the board, so every cell is free if the terrain is passable
+		self.occupied = set()
+		if terrain.passable:
+			self.free_cells = CellSet.every(size)
+			self.empty_cells = CellSet.every(size)
+		else:
+			self.free_cells = CellSet(size)
+			self.empty_cells = CellSet(size)
+			
+	#Packed grids, one byte per cell, that mirror properties of the terrain. Hot paths (FOV, line of sight, pathfinding,
+	#rendering) read these instead of going through the terrain table. They're rebuilt from the terrain grid, and must
+	#be kept in sync whenever a cell's terrain changes. Whether a cell has been revealed is only kept here.
+	
+	def rebuild_grids(self):
+		self.opaque = self.terrain.translate(OPAQUE_TABLE)
+		self.walkable = self.terrain.translate(WALKABLE_TABLE)
+		
+	def reveal(self, col, row):
+		"Marks a tile as revealed. Returns True if it wasn't revealed before."
+		index = col + row * self.cols
+		if self.revealed[index]:
+			return False
+		self.revealed[index] = 1
+		return True
+		
+	#Free cell index
+	#Placing things at random needs a random passable cell with no monster on it, and often also with no items there.
+	#Those cells are kept in CellSets, which are updated whenever terrain, monsters or items come or go, so that
+	#picking one doesn't have to keep trying random cells until it hits one.
+	#free_cells - Passable cells with no monster (or the player) on them, that is, where is_passable is true
+	#empty_cells - The free cells with no items on them
+	#occupied - The cells that have something in the monster collision cache
+	
+	def index_cells(self):
+		"Rebuilds the free cell index from scratch"
+		cols = self.cols
+		self.occupied = {x + y * cols for y, row in enumerate(self.mons_cache) if any(row) for x, m in enumerate(row) if m}
+		free = []
+		walkable = self.walkable
+		index = walkable.find(1)
+		while index != -1:
+			if index not in self.occupied:
+				free.append(index)
+			index = walkable.find(1, index + 1)
+		size = len(walkable)
+		self.free_cells = CellSet(size, free)
+		self.empty_cells = CellSet(size, [c for c in free if c not in self.items])
+		
+	def _reindex(self, col, row):
+		"Updates the free cell index for one cell"
+		index = col + row * self.cols
+		if self.mons_cache[row][col]:
+			self.occupied.add(index)
+			self.free_cells.discard(index)
+			self.empty_cells.discard(index)
+			return
+		self.occupied.discard(index)
+		if not self.walkable[index]:
+			self.free_cells.discard(index)
+			self.empty_cells.discard(index)
+			return
+		self.free_cells.add(index)
+		if index in self.items:
+			self.empty_cells.discard(index)
+		else:
+			self.empty_cells.add(index)
+			
+	def random_free_cell(self, no_items=False):
+		"Returns a random passable cell with no monster (and no items, if no_items is true) on it, or None if there isn't one"
+		cells = self.empty_cells if no_items else self.free_cells
+		if not cells:
+			return None
+		index = cells.choice()
+		return (index % self.cols, index // self.cols)
 		
 	def clear_cache(self):
-		self.mons_cache = [[None for x in range(self.cols)] for y in range(self.cols)]
+		mons_cache = self.mons_cache
+		cols = self.cols
+		for index in list(self.occupied): #Only the cells with something on them need to be cleared
+			row, col = divmod(index, cols)
+			mons_cache[row][col] = None
+			self._reindex(col, row)
 
 	def line_between(self, pos1, pos2, skipfirst=False, skiplast=False):
 		x1, y1 = pos1
@@ -55,17 +292,94 @@ class Board:
 	def in_bounds(self, x, y):
 		return 0 <= x < self.cols and 0 <= y < self.rows
 				
+	#Line of sight cache
+	#Lines between two points are looked up far more often than the terrain changes, so each line is only traced once
+	#until the terrain changes again. An entry stores the cells of the line, whether the terrain allows sight along it, and
+	#whether the terrain allows passage along it. Monsters aren't part of the cache, since they move every turn.
+	#Since the lines on a big board can be hundreds of cells long, the cache is limited by the total number of cells in its
+	#lines rather than by the number of lines.
+	
+	LOS_CACHE_CELLS = 200000
+	
+	def clear_los_cache(self):
+		self.los_cache = {}
+		self.los_cells = 0 #Total length of the lines in the cache
+		
+	def _trace_line(self, pos1, pos2):
+		if self.los_cells >= self.LOS_CACHE_CELLS:
+			self.clear_los_cache()
+		self.los_misses += 1
+		#Same Bresenham line as line_between, but built directly into a list
+		x1, y1 = pos1
+		x2, y2 = pos2
+		dx = abs(x2 - x1)
+		sx = 1 if x1 < x2 else -1
+		dy = -abs(y2 - y1)
+		sy = 1 if y1 < y2 else -1
+		error = dx + dy
+		line = [pos1]
+		while (x1, y1) != (x2, y2):
+			e2 = 2 * error
+			if e2 >= dy:
+				if x1 == x2:
+					break
+				error += dy
+				x1 += sx
+			if e2 <= dx:
+				if y1 == y2:
+					break
+				error += dx
+				y1 += sy
+			line.append((x1, y1))
+		opaque = self.opaque
+		walkable = self.walkable
+		cols = self.cols
+		sees = clear = True
+		for point in line:
+			if point == pos2:
+				continue
+			x, y = point
+			index = x + y * cols
+			if opaque[index]:
+				sees = False
+			if point != pos1 and not walkable[index]:
+				clear = False
+		entry = self.los_cache[(pos1, pos2)] = (tuple(line), sees, clear)
+		self.los_cells += len(line)
+		return entry
+		
+	def _los_entry(self, pos1, pos2):
+		entry = self.los_cache.get((pos1, pos2))
+		if entry is None:
+			return self._trace_line(pos1, pos2)
+		self.los_hits += 1
+		return entry
+		
+	def get_line(self, pos1, pos2):
+		"Returns the cells on the line from pos1 to pos2 (inclusive) as a tuple"
+		return self._los_entry(pos1, pos2)[0]
+	
 	def line_of_sight(self, pos1, pos2):
-		for point in self.line_between(pos1, pos2, skiplast=True):
-			if self.blocks_sight(*point):
-				return False
-		return True
+		entry = self.los_cache.get((pos1, pos2))
+		if entry is None:
+			return self._trace_line(pos1, pos2)[1]
+		self.los_hits += 1
+		return entry[1]
 		
 	def is_clear_path(self, pos1, pos2):
-		for point in self.line_between(pos1, pos2, skipfirst=True, skiplast=True):
-			if not self.is_passable(*point):
+		line, sees, clear = self._los_entry(pos1, pos2)
+		if not clear:
+			return False
+		mons_cache = self.mons_cache
+		for i in range(1, len(line) - 1):
+			x, y = line[i]
+			if mons_cache[y][x]:
 				return False
 		return True
+		
+	def los_hit_rate(self):
+		total = self.los_hits + self.los_misses
+		return self.los_hits / total if total else 0
 	
 	def get_in_radius(self, pos, radius):
 		x, y = pos
@@ -110,9 +424,11 @@ class Board:
 	
 	def set_cache(self, x, y, mon):
 		self.mons_cache[y][x] = mon
+		self._reindex(x, y)
 		
 	def unset_cache(self, x, y):
 		self.mons_cache[y][x] = None
+		self._reindex(x, y)
 		
 	def get_mon_cache(self, x, y):
 		return self.mons_cache[y][x]
@@ -125,25 +441,38 @@ class Board:
 		tmp = self.mons_cache[y1][x1]
 		self.mons_cache[y1][x1] = self.mons_cache[y2][x2]
 		self.mons_cache[y2][x2] = tmp
+		self._reindex(x1, y1)
+		self._reindex(x2, y2)
+		
+	#Note: The player always stands on a passable tile, so there is no need to special-case the player's position here
 		
 	def blocks_sight(self, col, row):
-		if (col, row) == (self.g.player.x, self.g.player.y):
-			return False
-		return not self.get(col, row).passable
+		return self.opaque[col + row * self.cols] == 1
 	
 	def is_passable(self, col, row):
-		if self.blocks_sight(col, row):
+		if not self.walkable[col + row * self.cols]:
 			return False
 		return not self.mons_cache[row][col]
 		
+	#Level generation is tuned for the default board size; bigger boards get proportionally more rooms.
+	#Rooms are sorted into buckets by position, so that placing a room only has to look at the rooms near it.
+	BASE_AREA = 40 * 16
+	ROOM_BUCKET = 16
+	
 	def generate(self):
-		self.data = [[Tile(False, "#") for x in range(self.cols)] for y in range(self.rows)]
+		self.fill(WALL)
 		self.clear_cache()
+		carve = self._carve
 		WIDTH_RANGE = (5, 10)
 		HEIGHT_RANGE = (3, 5)
 		ATTEMPTS = 100
 		NUM = random.randint(5, 8)
+		scale = self.cols * self.rows / self.BASE_AREA
+		large = scale > 1
+		if large:
+			NUM = round(NUM * scale)
 		rooms = []
+		buckets = {}
 		randchance = dice(2, 10)
 		if one_in(7):
 			randchance = 100
@@ -153,7 +482,7 @@ class Board:
 				height = random.randint(*HEIGHT_RANGE)
 				xpos = random.randint(1, self.cols - width - 1)
 				ypos = random.randint(1, self.rows - height - 1)
-				for x, y, w, h in rooms:
+				for x, y, w, h in self._rooms_near(buckets, xpos, ypos, width, height, 1):
 					flag = True
 					if x + w < xpos or xpos + width < x:
 						flag = False
@@ -164,11 +493,18 @@ class Board:
 				else:
 					for x in range(width):
 						for y in range(height):
-							self.carve_at(xpos + x, ypos + y)
-					if i > 0:
-						prev = rooms[-1]
-						if random.randint(1, randchance) == 1:
-							prev = random.choice(rooms)
+							carve(xpos + x, ypos + y)
+					if rooms:
+						if large:
+							#Joining rooms that are far apart would cover a big map in long corridors, so connect to one nearby
+							near = self._nearest_rooms(buckets, xpos, ypos, width, height)
+							prev = min(near, key=lambda r: abs(2*r[0] + r[2] - 2*xpos - width) + abs(2*r[1] + r[3] - 2*ypos - height))
+							if random.randint(1, randchance) == 1:
+								prev = random.choice(near)
+						else:
+							prev = rooms[-1]
+							if random.randint(1, randchance) == 1:
+								prev = random.choice(rooms)
 						x, y, w, h = prev
 						pos1_x = x + random.randint(1, w - 2)
 						pos1_y = y + random.randint(1, h - 2)
@@ -179,141 +515,251 @@ class Board:
 						if one_in(2):
 							x = pos1_x
 							while x != pos2_x:
-								self.carve_at(x, pos1_y)
+								carve(x, pos1_y)
 								x += dx	
 							y = pos1_y
 							while y != pos2_y:
-								self.carve_at(pos2_x, y)
+								carve(pos2_x, y)
 								y += dy
 						else:
 							y = pos1_y
 							while y != pos2_y:
-								self.carve_at(pos1_x, y)
+								carve(pos1_x, y)
 								y += dy
 							x = pos1_x
 							while x != pos2_x:
-								self.carve_at(x, pos2_y)
+								carve(x, pos2_y)
 								x += dx
 						
-					rooms.append((xpos, ypos, width, height))
+					room = (xpos, ypos, width, height)
+					rooms.append(room)
+					size = self.ROOM_BUCKET
+					for by in range(ypos // size, (ypos + height) // size + 1):
+						for bx in range(xpos // size, (xpos + width) // size + 1):
+							buckets.setdefault((bx, by), []).append(room)
 					break
+		self.rooms = rooms
+		self.terrain_changed()
+		self.index_cells()
+		
+	def room_graph(self):
+		"Returns the RoomGraph of the level's layout, which is built the first time it's needed after the terrain changes"
+		graph = self.room_graph_cache
+		if graph is None or graph.revision != self.revision:
+			graph = self.room_graph_cache = RoomGraph(self, self.rooms)
+		return graph
+					
+	def _rooms_near(self, buckets, x, y, w, h, margin):
+		"Returns the rooms in the buckets that overlap the given rectangle, grown by margin on each side"
+		size = self.ROOM_BUCKET
+		found = {}
+		for by in range((y - margin) // size, (y + h + margin) // size + 1):
+			for bx in range((x - margin) // size, (x + w + margin) // size + 1):
+				for room in buckets.get((bx, by), ()):
+					found[room] = None
+		return list(found)
+		
+	def _nearest_rooms(self, buckets, x, y, w, h):
+		"Returns the rooms in the nearest buckets around the given rectangle that have any rooms in them"
+		margin = self.ROOM_BUCKET
+		while True:
+			near = self._rooms_near(buckets, x, y, w, h, margin)
+			if near:
+				return near
+			margin *= 2
 							
 	def carve_at(self, col, row):
 		if not (0 <= col < self.cols and 0 <= row < self.rows):
 			raise ValueError(f"carve_at coordinate out of range: ({col}, {row})")
-		self.data[row][col] = Tile(True, " ")
+		self.set_terrain(col, row, FLOOR)
 		
-	def get(self, col, row):
-		return self.data[row][col]
+	def _carve(self, col, row):
+		"carve_at for use while generating, which leaves calling terrain_changed and rebuilding the free cell index until the end"
+		if not (0 <= col < self.cols and 0 <= row < self.rows):
+			raise ValueError(f"carve_at coordinate out of range: ({col}, {row})")
+		index = col + row * self.cols
+		self.terrain[index] = FLOOR.index
+		self.opaque[index] = 0
+		self.walkable[index] = 1
+		
+	def terrain_changed(self):
+		"Must be called whenever passability or opacity of a tile changes"
+		self.revision += 1
+		self.clear_los_cache()
+		
+	def terrain_at(self, col, row):
+		return TERRAIN[self.terrain[col + row * self.cols]]
+		
+	def set_terrain(self, col, row, terrain):
+		index = col + row * self.cols
+		self.terrain[index] = terrain.index
+		if self.redraw is not None:
+			self.redraw.add(index)
+		opaque = not terrain.passable
+		if self.opaque[index] != opaque or self.walkable[index] != terrain.passable:
+			self.opaque[index] = opaque
+			self.walkable[index] = terrain.passable
+			self._reindex(col, row)
+			self.terrain_changed()
+			
+	def items_at(self, col, row):
+		"Returns the items lying at a position, topmost last. This must not be changed directly; use add_item and take_item instead."
+		return self.items.get(col + row * self.cols, ())
+		
+	def add_item(self, col, row, item):
+		index = col + row * self.cols
+		items = self.items.get(index)
+		if self.redraw is not None:
+			self.redraw.add(index)
+		if items is None:
+			self.items[index] = [item]
+			self.empty_cells.discard(index)
+		else:
+			items.append(item)
+			
+	def take_item(self, col, row):
+		"Removes and returns the topmost item at a position"
+		index = col + row * self.cols
+		items = self.items[index]
+		item = items.pop()
+		if self.redraw is not None:
+			self.redraw.add(index)
+		if not items:
+			del self.items[index]
+			self._reindex(col, row)
+		return item
+		
+	def walk(self, col, row):
+		"Marks a tile as walked on by the player. Returns True if it wasn't walked on before."
+		index = col + row * self.cols
+		if index in self.walked:
+			return False
+		self.walked.add(index)
+		return True
 		
 ###############
 #Pathfinding
 #Algorithm used is A* Search
-from collections import defaultdict
+#Cells are referred to by their index (y*cols + x), and the g-scores and parents are stored in flat lists that are
+#allocated once per board. Instead of clearing those lists for every search, each search gets a new generation
+#number, and an entry only counts as set if its stamp matches the current generation.
+import heapq
 
-class OpenSet:
+class PathScratch:
 	
-	def __init__(self, key=None):
-		self._data = []
-		self._dup = set()
-		self.key = key or (lambda v: v)
-		
-	def add(self, value):
-		if value in self._dup:
-			return
-		self._dup.add(value)
-		a = self._data
-		key = self.key
-		i = len(a)
-		a.append(value)
-		while i > 0:
-			parent = i // 2
-			if key(a[parent]) < key(a[i]):
-				break
-			a[parent], a[i] = a[i], a[parent]
-			i = parent
-			
-	def pop(self):
-		if len(self._data) == 0:
-			raise IndexError("pop from an empty heap")
-		a = self._data
-		val = a[0]
-		a[0] = a[-1]
-		a.pop()
-		key = self.key
-		i = 0
-		while True:
-			left = 2 * i + 1
-			right = 2 * i + 2
-			if left >= len(a):
-				break
-			node = left
-			if right < len(a) and key(a[right]) < key(a[left]):
-				node = right
-			if key(a[i]) > key(a[node]):
-				a[i], a[node] = a[node], a[i]
-				i = node
-			else:
-				break
-		self._dup.remove(val)
-		return val
-		
-	def __contains__(self, value):
-		return value in self._dup
-		
-	def __bool__(self):
-		return len(self._data) > 0
+	def __init__(self, size):
+		self.size = size
+		self.gscore = [0] * size
+		self.parent = [0] * size
+		self.seen = [0] * size #Generation in which gscore/parent were last set
+		self.closed = [0] * size #Generation in which the cell was last expanded
+		self.generation = 0
 		
+	def next_generation(self):
+		self.generation += 1
+		return self.generation
+
 def pathfind(board, start, end, *, rand=False):
-	#Actual A* Search algorithm
-	def h(a, b):
-		return abs(a[0] - b[0]) + abs(a[1] - b[1])
-	gScore = defaultdict(lambda: float("inf"))
-	gScore[start] = 0
-	fScore = defaultdict(lambda: float("inf"))
-	fScore[start] = h(start, end)
-	open_set = OpenSet(fScore.__getitem__)
-	open_set.add(start)
-	came_from = {}
-	rows = board.rows
 	cols = board.cols
-	def can_pass(x, y):
-		if (x, y) == end:
-			return not board.blocks_sight(x, y)
-		return board.is_passable(x, y)
-	while open_set:
-		curr = open_set.pop()
-		if curr == end:
-			path = [curr]
-			while curr in came_from:
-				curr = came_from[curr]
-				path.append(curr)
+	rows = board.rows
+	size = cols * rows
+	scratch = board.path_scratch
+	if scratch is None or scratch.size != size:
+		scratch = board.path_scratch = PathScratch(size)
+	gen = scratch.next_generation()
+	gscore = scratch.gscore
+	parent = scratch.parent
+	seen = scratch.seen
+	closed = scratch.closed
+	walkable = board.walkable
+	mons_cache = board.mons_cache
+	
+	sx, sy = start
+	ex, ey = end
+	si = sx + sy * cols
+	ei = ex + ey * cols
+	seen[si] = gen
+	gscore[si] = 0
+	parent[si] = -1
+	heappush = heapq.heappush
+	heappop = heapq.heappop
+	shuffle = random.shuffle
+	rnd = random.random
+	dirs = [(1, 0, 1), (-1, 0, -1), (0, 1, cols), (0, -1, -cols)]
+	open_heap = [(abs(sx - ex) + abs(sy - ey), 0, si)]
+	while open_heap:
+		curr = heappop(open_heap)[2]
+		if curr == ei:
+			path = []
+			while curr != -1:
+				y, x = divmod(curr, cols)
+				path.append((x, y))
+				curr = parent[curr]
 			path.reverse()
 			return path
-		neighbors = []
-		x, y = curr
-		if x + 1 < cols and can_pass(x + 1, y): 
-			neighbors.append((x + 1, y))
-		if x - 1 >= 0 and can_pass(x - 1, y): 
-			neighbors.append((x - 1, y))
-		if y + 1 < rows and can_pass(x, y + 1): 
-			neighbors.append((x, y + 1))
-		if y - 1 >= 0 and can_pass(x, y - 1):
-			neighbors.append((x, y - 1))
+		if closed[curr] == gen:
+			continue
+		closed[curr] = gen
+		y, x = divmod(curr, cols)
 		if rand:
-			random.shuffle(neighbors)
-		
-		for n in neighbors:
-			cost = 1
-			t = gScore[curr] + cost
-			if t < gScore[n]:
-				came_from[n] = curr
-				gScore[n] = t
-				fScore[n] = t + h(n, end)
-				
-				if n not in open_set:
-					open_set.add(n)
+			shuffle(dirs)
+		t = gscore[curr] + 1
+		for dx, dy, di in dirs:
+			nx = x + dx
+			ny = y + dy
+			if not (0 <= nx < cols and 0 <= ny < rows):
+				continue
+			n = curr + di
+			if not walkable[n] or (n != ei and mons_cache[ny][nx]):
+				continue
+			if seen[n] == gen and t >= gscore[n]:
+				continue
+			seen[n] = gen
+			gscore[n] = t
+			parent[n] = curr
+			#Among equal f-scores, prefer the cells furthest along (highest g), which avoids expanding
+			#whole rooms worth of equally good cells; with rand=True, remaining ties are broken randomly
+			tiebreak = rnd() - t if rand else -t
+			heappush(open_heap, (t + abs(nx - ex) + abs(ny - ey), tiebreak, n))
 	return []
 
+def distance_map(board, start, limit=None):
+	"""
+	Breadth-first search outward from start over passable terrain, ignoring monsters.
+	Returns a dict mapping y*cols + x to the number of steps to start, for every cell reached (within limit steps,
+	if given). Only the reached cells are stored, so a search with a limit costs the same however big the board is.
+	"""
+	cols = board.cols
+	size = cols * board.rows
+	walkable = board.walkable
+	sx, sy = start
+	si = sx + sy * cols
+	dist = {si: 0}
+	frontier = [si]
+	d = 0
+	while frontier:
+		d += 1
+		if limit is not None and d > limit:
+			break
+		nxt = []
+		for curr in frontier:
+			x = curr % cols
+			for n in (curr + cols, curr - cols):
+				if 0 <= n < size and n not in dist and walkable[n]:
+					dist[n] = d
+					nxt.append(n)
+			if x + 1 < cols:
+				n = curr + 1
+				if n not in dist and walkable[n]:
+					dist[n] = d
+					nxt.append(n)
+			if x > 0:
+				n = curr - 1
+				if n not in dist and walkable[n]:
+					dist[n] = d
+					nxt.append(n)
+		frontier = nxt
+	return dist
+
 #End pathfinding
 ###############	
\ No newline at end of file
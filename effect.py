@@ -1,4 +1,4 @@
-import random
+from rng import random
 
 class Effect:
 	name = "Generic Effect"
@@ -1,8 +1,23 @@
-import random
+from rng import random
 from collections import deque
 from board import pathfind
+from fov import FovCache
+
+#Counters for how often path_towards was able to follow (or adjust) its cached path rather than searching again
+path_stats = {"reuses": 0, "splices": 0, "replans": 0, "routes": 0}
+
+PATH_LOOKAHEAD = 3 #How many upcoming cells of a cached path are checked before following it
+MAX_SPLICE = 2 #How far the target may move before a cached path is discarded
+PLACE_TRIES = 20 #How many random free cells place_randomly tries before checking all of them
+#Paths to targets further away than this are planned over the room graph first, and only the next leg of the route,
+#about ROUTE_LEG cells long, is searched for cell by cell. Boards of the default size are never this far across.
+LONG_PATH = 60
+ROUTE_LEG = 20
 
 class Entity:
+	fov_algorithm = "shadowcast" #Either "shadowcast" or "raycast"; the old raycasting algorithm is kept for comparison
+	target = None #The entity this one is chasing, if any
+	fov_cache = None #Created the first time calc_fov is called, since most entities never need one
 	
 	def __init__(self, g):
 		self.g = g
@@ -14,8 +29,25 @@ class Entity:
 		self.energy = 0 #How many energy points this entity has. Used to control movement speed.
 		self.fov = set()
 		
+	def __getstate__(self):
+		d = self.__dict__.copy()
+		d.pop("fov_cache", None) #Cheap to rebuild, so there's no need to save it
+		return d
+		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.__dict__.setdefault("fov", set())
+		
 	def calc_fov(self):
 		"Calculates all tiles an entity can see from the current position"
+		if self.fov_algorithm == "raycast":
+			return self.calc_fov_raycast()
+		cache = self.fov_cache
+		if cache is None:
+			cache = self.fov_cache = FovCache()
+		return cache.get(self.g.board, self.x, self.y)
+		
+	def calc_fov_raycast(self):
 		board = self.g.board
 		fov = set()
 		fov.add((self.x, self.y))
@@ -54,7 +86,7 @@ class Entity:
 				seen.add((xp, yp))
 				if not (0 <= xp < board.cols):
 					continue
-				if not (0 <= yp < board.cols):
+				if not (0 <= yp < board.rows):
 					continue
 				if board.blocks_sight(xp, yp):
 					visible = False
@@ -89,12 +121,72 @@ class Entity:
 	def clear_path(self):
 		self.curr_path.clear()
 		
+	def _splice_path(self, x, y):
+		"Adjusts the cached path for a target that moved a short distance. Returns True if the path could be kept."
+		path = self.curr_path
+		tx, ty = self.curr_target
+		if abs(tx - x) + abs(ty - y) > MAX_SPLICE:
+			return False
+		if path[-1] != (tx, ty): #Only the next leg of a long route, which still leads the right way
+			return True
+		#If the new target is on or next to the path, cut the path short there
+		for i, (px, py) in enumerate(path):
+			d = abs(px - x) + abs(py - y)
+			if d <= 1:
+				for _ in range(len(path) - i - 1):
+					path.pop()
+				if d == 1:
+					path.append((x, y))
+				return True
+		#Otherwise, extend the path from the old target to the new one
+		extra = pathfind(self.g.board, (tx, ty), (x, y))
+		if not extra or len(extra) - 1 > 2 * MAX_SPLICE:
+			return False
+		path.extend(extra[1:])
+		return True
+		
+	def _path_clear_ahead(self):
+		"Checks the next few cells of the cached path against the current state of the board"
+		board = self.g.board
+		path = self.curr_path
+		fx, fy = path[0]
+		if abs(fx - self.x) + abs(fy - self.y) != 1:
+			return False
+		for i in range(min(PATH_LOOKAHEAD, len(path))):
+			x, y = path[i]
+			if board.blocks_sight(x, y):
+				return False
+			#Monsters further along the path are likely to have moved out of the way by the time we get there,
+			#so only the cell we're about to step into needs to be free. It may be taken by whatever we're chasing,
+			#if the path ends there.
+			if i == 0 and not board.is_passable(x, y):
+				if (x, y) != self.curr_target or self.target is None or board.get_mon_cache(x, y) is not self.target:
+					return False
+		return True
+		
 	def path_towards(self, x, y, maxlen=None):
-		if self.curr_target == (x, y) and self.curr_path and self.move_to(*self.curr_path.popleft()):
-			if (self.x, self.y) == (x, y):
+		target = (x, y)
+		if self.curr_path and self.curr_target != target:
+			if self._splice_path(x, y):
+				path_stats["splices"] += 1
+				self.curr_target = target
+			else:
 				self.clear_path()
-			return
-		path = pathfind(self.g.board, (self.x, self.y), (x, y), rand=True)
+		if self.curr_path and (not maxlen or len(self.curr_path) <= maxlen) and self._path_clear_ahead():
+			if self.move_to(*self.curr_path.popleft()):
+				path_stats["reuses"] += 1
+				if (self.x, self.y) == target:
+					self.clear_path()
+				return
+			#The step was refused, e.g. because the cell was taken since it was checked, so the path is off by a step now
+			self.clear_path()
+		path_stats["replans"] += 1
+		goal = target
+		if not maxlen and abs(self.x - x) + abs(self.y - y) > LONG_PATH:
+			goal = self._route_leg(x, y)
+			if goal is None:
+				return
+		path = pathfind(self.g.board, (self.x, self.y), goal, rand=True)
 		if len(path) < 2:
 			return
 		if maxlen and len(path) > maxlen+1:
@@ -107,6 +199,17 @@ class Entity:
 		dy = newY - currY
 		self.move(dx, dy)
 		
+	def _route_leg(self, x, y):
+		"Plans a route to (x, y) over the room graph, and returns the waypoint at the end of its next leg; or None if (x, y) can't be reached"
+		path_stats["routes"] += 1
+		waypoints = self.g.board.room_graph().route((self.x, self.y), (x, y))
+		if waypoints is None:
+			return None
+		for wx, wy in waypoints:
+			if abs(wx - self.x) + abs(wy - self.y) >= ROUTE_LEG:
+				return (wx, wy)
+		return (x, y)
+		
 	def set_path(self, path):
 		self.curr_path = deque(path)
 		
@@ -124,28 +227,23 @@ class Entity:
 		
 	def place_randomly(self):
 		board = self.g.board
-		for _ in range(200):
-			x = random.randint(1, board.cols - 2)
-			y = random.randint(1, board.rows - 2)
-			if self.can_place(x, y):
+		for _ in range(PLACE_TRIES):
+			pos = board.random_free_cell()
+			if pos is None:
+				return False
+			if self.can_place(*pos):
 				break
-		else: #We couldn't place the player randomly, so let's search all possible positions in a random order
-			row_ind = list(range(1, board.rows - 1))
-			random.shuffle(row_ind)
-			found = False
-			for ypos in row_ind:
-				col_ind = list(range(1, board.cols - 1))
-				random.shuffle(col_ind)
-				for xpos in col_ind:
-					if self.can_place(xpos, ypos):
-						x, y = xpos, ypos
-						found = True
-						break
-				if found:
+		else: #Every cell we tried was hemmed in, so let's check all the free cells in a random order
+			cols = board.cols
+			cells = board.free_cells.cells[:]
+			random.shuffle(cells)
+			for index in cells:
+				pos = (index % cols, index // cols)
+				if self.can_place(*pos):
 					break
 			else:
-				 return False
-		self.place_at(x, y)
+				return False
+		self.place_at(*pos)
 		return True
 		
 	def place_at(self, x, y):
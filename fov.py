@@ -0,0 +1,107 @@
+#Field of view
+#Algorithm used is symmetric recursive shadowcasting (with an explicit stack instead of recursion)
+#Each quadrant is scanned row by row outward from the viewer, and the shadows cast by walls are tracked as slope ranges
+#so that every cell in a quadrant is looked at no more than once.
+#Slopes are kept as integer fractions (numerator, denominator) to avoid floating point error.
+from collections import OrderedDict
+
+#(dx, dy) for "depth" and "column" in each of the four quadrants
+QUADRANTS = [
+	((0, -1), (1, 0)), #North
+	((1, 0), (0, 1)), #East
+	((0, 1), (1, 0)), #South
+	((-1, 0), (0, 1)), #West
+]
+
+def shadowcast(board, ox, oy, radius=None):
+	"Calculates the set of cells visible from (ox, oy) using symmetric shadowcasting"
+	cols = board.cols
+	rows = board.rows
+	opaque = board.opaque
+	fov = {(ox, oy)}
+	add = fov.add
+	if radius is None:
+		radius = max(cols, rows)
+	for (ddx, ddy), (cdx, cdy) in QUADRANTS:
+		#Each entry: (depth, start_num, start_den, end_num, end_den)
+		stack = [(1, -1, 1, 1, 1)]
+		while stack:
+			depth, sn, sd, en, ed = stack.pop()
+			if depth > radius:
+				continue
+			#Columns range from round_ties_up(depth * start) to round_ties_down(depth * end)
+			min_col = (2 * depth * sn + sd) // (2 * sd)
+			max_col = -((ed - 2 * depth * en) // (2 * ed))
+			prev_wall = -1 #No previous cell yet
+			bx = ox + ddx * depth
+			by = oy + ddy * depth
+			for col in range(min_col, max_col + 1):
+				x = bx + cdx * col
+				y = by + cdy * col
+				if 0 <= x < cols and 0 <= y < rows:
+					wall = opaque[x + y * cols]
+					#Walls are always revealed; floors only if the viewer would also be visible from them
+					if wall or (col * sd >= depth * sn and col * ed <= depth * en):
+						add((x, y))
+				else:
+					wall = 1
+				if prev_wall == 1 and not wall:
+					#Slope of the left edge of this cell becomes the new start slope
+					sn, sd = 2 * col - 1, 2 * depth
+				elif prev_wall == 0 and wall:
+					stack.append((depth + 1, sn, sd, 2 * col - 1, 2 * depth))
+				prev_wall = wall
+			if prev_wall == 0:
+				stack.append((depth + 1, sn, sd, en, ed))
+	return fov
+
+class FovCache:
+	"""
+	Remembers the field of view calculated at the last few viewer positions.
+	Every shadow in every quadrant depends on the exact viewer position, so nothing from one position can be
+	safely reused at another; instead, the results are kept per position and reused when the viewer steps back
+	onto one of them (e.g. pacing up and down a corridor, or fighting in a doorway).
+	This doesn't recompute only the part of the view that a step affects: walking forward onto new positions gets
+	nothing from the cache, and costs a full shadowcast per step (see bench.py fov_forward).
+	The whole cache is invalidated whenever the board's revision changes.
+	"""
+	
+	def __init__(self, size=64):
+		self.size = size
+		self.board = None
+		self.revision = None
+		self.entries = OrderedDict()
+		self.last_pos = None
+		self.last_fov = set()
+		self.hits = 0
+		self.misses = 0
+		
+	def invalidate(self):
+		self.entries.clear()
+		self.last_pos = None
+		self.last_fov = set()
+		
+	def get(self, board, x, y):
+		"Returns the set of cells visible from (x, y). The returned set is shared with the cache, and should not be modified."
+		if board is not self.board or board.revision != self.revision:
+			self.invalidate()
+			self.board = board
+			self.revision = board.revision
+		pos = (x, y)
+		if pos == self.last_pos:
+			self.hits += 1
+			return self.last_fov
+		entries = self.entries
+		fov = entries.get(pos)
+		if fov is not None:
+			self.hits += 1
+			entries.move_to_end(pos)
+		else:
+			self.misses += 1
+			fov = shadowcast(board, x, y)
+			entries[pos] = fov
+			if len(entries) > self.size:
+				entries.popitem(last=False)
+		self.last_pos = pos
+		self.last_fov = fov
+		return fov
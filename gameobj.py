@@ -1,23 +1,41 @@
-import random, curses, textwrap, time
+import curses, textwrap, time
 from os import get_terminal_size, path
 from itertools import islice
 from collections import deque
 
 from utils import *
-from board import Board
+from rng import random, RandomStreams, uses_stream
+from board import Board, TERRAIN, distance_map
 from player import Player
 from effect import Effect
 from monster import Monster
+from scheduler import Scheduler
+from headless import HeadlessScreen
+from render import Renderer
+from saving import SaveWriter
+from savefile import decode_game, SaveJournal, journal_path
 from items import *
 
 import pickle
 
+FAST_FORWARD_BATCH = 50 #How many turns of resting or activities are run between checks for input
+APPROACH_RANGE = 100 #How many steps out from the player the shared approach map reaches
+
+#Boards can be anywhere from MIN_BOARD_SIZE up to MAX_BOARD_SIZE; if one doesn't fit on the screen, the view scrolls
+#to follow the player
+DEFAULT_BOARD_SIZE = (40, 16)
+MIN_BOARD_SIZE = (20, 10)
+MAX_BOARD_SIZE = (500, 500)
+SIDEBAR_WIDTH = 20 #Room kept to the right of a scrolling view for the player's stats
+MESSAGE_LINES = 8
+CAMERA_MARGIN = 8 #How close the player can get to the edge of a scrolling view before it recenters
+
 class GameTextMenu:
 	
 	def __init__(self, g):
 		self.screen = g.screen
 		self.g = g
-		size = get_terminal_size()
+		size = g.term_size()
 		self.termwidth = size.columns
 		self.msg = []
 		
@@ -32,6 +50,7 @@ class GameTextMenu:
 		self.msg.clear()
 	
 	def display(self):
+		self.g.renderer.invalidate()
 		self.screen.clear()
 		for i in range(len(self.msg)):
 			self.screen.addstr(i, 0, self.msg[i])
@@ -52,72 +71,192 @@ class GameTextMenu:
 class Game:
 	_INST = None
 	
-	def __new__(cls):
+	def __new__(cls, *args, **kwargs):
 		if cls._INST:
 			return cls._INST
 		obj = object.__new__(cls)
 		cls._INST = obj
 		return obj
 	
-	def __init__(self):
-		self.screen = curses.initscr()
-		curses.start_color()
-		curses.init_pair(1, curses.COLOR_RED, 0)
-		curses.init_pair(2, curses.COLOR_GREEN, 0)
-		curses.init_pair(3, curses.COLOR_YELLOW, 0)
-		curses.init_pair(4, curses.COLOR_BLUE, 0)
-		curses.init_pair(5, curses.COLOR_MAGENTA, 0)
-		curses.init_pair(6, curses.COLOR_CYAN, 0)
+	def __init__(self, headless=False, keys=(), save_path="save.dat", seed=None, screen=None, board_size=DEFAULT_BOARD_SIZE):
+		"""
+		headless - If true, runs without a terminal: nothing is drawn to the screen, animations don't wait,
+		and input is read from keys (any iterable of characters or key codes) instead of the keyboard
+		screen - For a headless game, a HeadlessScreen to use instead of one reading from keys
+		save_path - Where the game is saved
+		seed - Seed for all of the game's randomness; if not given, a random one is picked
+		board_size - The board's size in (columns, rows)
+		"""
+		self.rng = RandomStreams(seed)
+		self.rng.activate()
+		self.headless = headless
+		self.save_path = save_path
+		self.saver = SaveWriter()
+		self.journal = SaveJournal()
+		if headless:
+			self.screen = screen or HeadlessScreen(keys)
+		else:
+			self.screen = curses.initscr()
+			curses.start_color()
+			curses.init_pair(1, curses.COLOR_RED, 0)
+			curses.init_pair(2, curses.COLOR_GREEN, 0)
+			curses.init_pair(3, curses.COLOR_YELLOW, 0)
+			curses.init_pair(4, curses.COLOR_BLUE, 0)
+			curses.init_pair(5, curses.COLOR_MAGENTA, 0)
+			curses.init_pair(6, curses.COLOR_CYAN, 0)
+		self.renderer = Renderer(self.screen, None if headless else curses.doupdate)
 		
 		self.screen.clear()
-		curses.noecho()
-		self.board = Board(self, 40, 16)
+		self.set_echo(False)
+		cols, rows = board_size
+		if not (MIN_BOARD_SIZE[0] <= cols <= MAX_BOARD_SIZE[0] and MIN_BOARD_SIZE[1] <= rows <= MAX_BOARD_SIZE[1]):
+			raise ValueError(f"Board size must be between {MIN_BOARD_SIZE} and {MAX_BOARD_SIZE}, not {board_size}")
+		self.board = Board(self, cols, rows)
 		self.player = Player(self)
 		self.monsters = []
+		self.scheduler = Scheduler()
 		self.msg_list = deque(maxlen=50)
 		self.msg_cursor = 0
 		self.blast = set()
 		self.projectile = None
 		self.select = None
 		self.level = 1
-		self.revealed = []
+		self.stairs_pending = False #Whether the level was cleared with nowhere to put the stairs, which are then put down on a later turn
 		self.last_save = time.time()
 		types = Effect.__subclasses__()
 		self.effect_types = {t.name:t for t in types}
 		self.mon_types = Monster.__subclasses__()
+		self.approach_key = None
+		self.approach = None
+		self.camera = (0, 0) #Top left corner of the part of the board shown on screen
+		self.drawn = None #What draw_board needs to know about the last frame to draw only what changed
 		
 	def __getstate__(self):
 		d = self.__dict__.copy()
 		del d["screen"]
+		del d["renderer"]
+		del d["headless"]
+		del d["save_path"]
+		del d["saver"]
+		del d["journal"]
+		del d["camera"]
+		del d["drawn"]
+		d["approach_key"] = d["approach"] = None
 		return d
 	
 	def __setstate__(self, state):
+		#Since Game is a singleton, loading a save updates the existing instance, which keeps its own screen
 		self.__dict__.update(state)
-		self.screen = curses.initscr()
+		self.__dict__.setdefault("approach_key", None)
+		self.__dict__.setdefault("approach", None)
+		self.__dict__.setdefault("camera", (0, 0))
+		self.__dict__.setdefault("drawn", None)
+		self.__dict__.setdefault("stairs_pending", False)
+		self.__dict__.pop("revealed", None) #A list of revealed cells that older versions kept, which the board already has
+		if "rng" not in state:
+			self.rng = RandomStreams()
+		self.rng.activate()
+		if "scheduler" not in state:
+			self.scheduler = Scheduler()
+			for m in self.monsters:
+				self.scheduler.add(m)
+		if "screen" not in self.__dict__:
+			self.headless = False
+			self.save_path = "save.dat"
+			self.saver = SaveWriter()
+			self.journal = SaveJournal()
+			self.screen = curses.initscr()
+			self.renderer = Renderer(self.screen, curses.doupdate)
+		self.renderer.invalidate()
+			
+	#Terminal access goes through these, so that they can be skipped when running headless
+	
+	def term_size(self):
+		if self.headless:
+			return self.screen.size()
+		return get_terminal_size()
+		
+	def color(self, pair):
+		if self.headless:
+			return pair << 8 #Same value curses.color_pair() gives
+		return curses.color_pair(pair)
+		
+	def set_echo(self, echo):
+		if self.headless:
+			return
+		if echo:
+			curses.echo()
+		else:
+			curses.noecho()
+			
+	def flush_input(self):
+		if not self.headless:
+			curses.flushinp()
+			
+	def close_screen(self):
+		if not self.headless:
+			curses.nocbreak()
+			curses.echo()
+			curses.endwin()
+			
+	def delay(self, seconds):
+		"Pauses for an animation frame"
+		if not self.headless:
+			time.sleep(seconds)
+		
+	def legacy_save_path(self):
+		"Where older versions of the game saved, by pickling the whole game"
+		return path.splitext(self.save_path)[0] + ".pickle"
 		
 	def load_game(self):
 		try:
-			obj = pickle.load(open("save.pickle", "rb"))
-			self.__dict__.update(obj.__dict__)
+			if path.exists(self.save_path):
+				with open(self.save_path, "rb") as f:
+					data = f.read()
+				journal = None
+				if path.exists(journal_path(self.save_path)):
+					with open(journal_path(self.save_path), "rb") as f:
+						journal = f.read()
+				decode_game(self, data, journal)
+				self.journal.reset()
+			else:
+				obj = pickle.load(open(self.legacy_save_path(), "rb"))
+				self.__dict__.update(obj.__dict__)
 		except:
 			self.print_msg("Unable to load saved game.", "yellow")
 			self.delete_saved_game()
 			
-	def save_game(self):
-		pickle.dump(self, open("save.pickle", "wb"))
+	def save_game(self, wait=False):
+		"Saves the game in the background. If wait is true, returns only once the save is on disk."
+		saver = self.saver
+		if saver.error:
+			self.print_msg(f"Unable to save the game: {saver.error}", "yellow")
+			saver.error = None
+			self.journal.reset() #The journal can't be trusted after a failed write, so start over with a full save
+		#Taking the snapshot here, rather than on the save thread, ensures the save doesn't catch the game halfway through a
+		#change. Encoding it is left to the save thread.
+		journal = self.journal
+		snapshot = journal.snapshot(self)
+		save_path = self.save_path
+		saver.submit(lambda: journal.writes(snapshot, save_path), replaces=snapshot[1])
 		self.last_save = time.time()
+		if wait:
+			saver.flush()
 		
 	def autosave(self):
 		if time.time() - self.last_save > 1:
 			self.save_game()
 		
 	def has_saved_game(self):
-		return path.exists("save.pickle")
+		return path.exists(self.save_path) or path.exists(self.legacy_save_path())
 	
 	def delete_saved_game(self):
-		if self.has_saved_game():
-			import os
-			os.remove("save.pickle")
+		self.saver.cancel()
+		self.journal.reset()
+		import os
+		for p in (self.save_path, journal_path(self.save_path), self.legacy_save_path()):
+			if path.exists(p):
+				os.remove(p)
 	
 	def help_menu(self):
 		menu = GameTextMenu(self)
@@ -191,15 +330,16 @@ class Game:
 		self.projectile = None
 		
 	def spawn_item(self, item, pos):
-		self.board.get(*pos).items.append(item)
+		self.board.add_item(*pos, item)
 		
 	def input(self, message=None):
 		if message:
 			self.print_msg(message)
 		self.draw_board()
-		curses.echo()
+		self.set_echo(True)
 		string = self.screen.getstr()
-		curses.noecho()
+		self.set_echo(False)
+		self.renderer.invalidate() #The typed text was echoed onto the screen
 		self.draw_board()
 		return string.decode()
 		
@@ -229,7 +369,7 @@ class Game:
 			if last != index:
 				self.draw_board()
 				last = index
-			curses.flushinp()
+			self.flush_input()
 			num = self.screen.getch()
 			char = chr(num)
 			if char == "a":
@@ -245,27 +385,38 @@ class Game:
 		self.select = None
 		return monsters[index]
 		
+	def register_monster(self, m):
+		"Adds a monster that has already been placed on the board"
+		self.monsters.append(m)
+		self.scheduler.add(m)
+		
 	def add_monster(self, m):
 		if m.place_randomly():
-			self.monsters.append(m)
+			self.register_monster(m)
 			
 	def add_monster_at(self, m, pos):
-		if m.place_randomly():
-			self.monsters.append(m)
+		m.place_at(*pos)
+		self.register_monster(m)
 			
 	def place_monster(self, typ):
 		m = typ(self)
 		if m.place_randomly():
-			self.monsters.append(m)
+			self.register_monster(m)
 			return m
 		return None
 	
+	@uses_stream("gen")
 	def generate_level(self):
 		self.monsters.clear()
+		self.scheduler.clear()
+		self.stairs_pending = False
 		self.board.generate()
 		self.player.rand_place()
 		self.player.fov = self.player.calc_fov()
 		num = random.randint(3, 4) + random.randint(0, int(1.4*(self.level - 1)**0.65))
+		scale = self.board.cols * self.board.rows / Board.BASE_AREA
+		if scale > 1: #Bigger boards get proportionally more monsters
+			num = round(num * scale)
 		monsters = self.mon_types
 		pool = []
 		for t in monsters:
@@ -288,18 +439,14 @@ class Game:
 							break
 						m.place_randomly()
 						los_tries -= 1
-				self.monsters.append(m)
+				self.register_monster(m)
 		
 		def place_item(typ):
-			for j in range(600):
-				x = random.randint(1, self.board.cols - 2)
-				y = random.randint(1, self.board.rows - 2)
-				if self.board.is_passable(x, y):
-					tile = self.board.get(x, y)
-					if not tile.items:
-						tile.items.append(item := typ())
-						return item
-			return None
+			pos = self.board.random_free_cell(no_items=True)
+			if pos is None:
+				return None
+			self.board.add_item(*pos, item := typ())
+			return item
 			
 		def apply_rand_enchant(item):
 			if isinstance(item, Weapon):
@@ -396,10 +543,23 @@ class Game:
 					place_item(random.choice(types))
 						
 		
-		self.revealed.clear()
 		self.draw_board()
 		self.refresh_cache()
 	
+	def get_approach_map(self):
+		"""
+		Returns a distance field rooted at the player (see board.distance_map).
+		It's recalculated at most once per player position, and shared by every monster chasing the player.
+		It only reaches APPROACH_RANGE steps out, so that it stays cheap on big boards; monsters further away than that
+		find their own path instead.
+		"""
+		board = self.board
+		key = (self.player.x, self.player.y, board.revision)
+		if self.approach_key != key:
+			self.approach = distance_map(board, (self.player.x, self.player.y), APPROACH_RANGE)
+			self.approach_key = key
+		return self.approach
+		
 	def monster_at(self, x, y, include_player=False):
 		if (x, y) == (self.player.x, self.player.y):
 			return include_player
@@ -419,6 +579,7 @@ class Game:
 		else:
 			mons[ind], mons[-1] = mons[-1], mons[ind]
 			del mons[-1]
+			self.scheduler.remove(m)
 			self.board.unset_cache(m.x, m.y)
 	
 	def print_msg_if_sees(self, pos, msg, color=None):
@@ -433,168 +594,252 @@ class Game:
 			"yellow": 3
 		}
 		color = m.get(color, 0)
-		size = get_terminal_size()
+		size = self.term_size()
 		termwidth = size.columns
 		for line in str(msg).splitlines():
 			self.msg_list.extend(map(lambda s: (s, color), textwrap.wrap(line, termwidth)))
 		self.msg_cursor = max(0, len(self.msg_list) - self.get_max_lines())
 		
 	def get_max_lines(self):
-		return min(8, get_terminal_size().lines - (self.board.rows + 2))
+		return min(MESSAGE_LINES, self.term_size().lines - (self.view_size()[1] + 2))
+		
+	def view_size(self):
+		"Returns how many columns and rows of the board are shown on screen"
+		size = self.term_size()
+		board = self.board
+		cols = board.cols
+		if cols > size.columns:
+			cols = max(1, size.columns - SIDEBAR_WIDTH)
+		rows = board.rows
+		if rows + 3 > size.lines: #Not even one line would be left for messages
+			rows = max(1, size.lines - 2 - MESSAGE_LINES)
+		return cols, rows
+		
+	def update_camera(self, view_cols, view_rows):
+		"Scrolls the view so that the player is on screen, recentering it when the player gets too close to an edge"
+		def scroll(start, pos, view, total):
+			if view >= total:
+				return 0
+			margin = min(CAMERA_MARGIN, view // 4)
+			if not (start + margin <= pos < start + view - margin):
+				start = pos - view // 2
+			return max(0, min(start, total - view))
+		x0, y0 = self.camera
+		self.camera = (scroll(x0, self.player.x, view_cols, self.board.cols), scroll(y0, self.player.y, view_rows, self.board.rows))
+		return self.camera
 		
 	def draw_board(self):
-		screen = self.screen
+		#Only the parts of the map that might look different from the last frame are drawn again: cells that came into
+		#or went out of view, cells whose terrain or items changed, and wherever the player, monsters, a blast or a
+		#projectile were or are now. Anything else about the frame (e.g. a scrolled view) draws the whole map.
+		screen = self.renderer
 		board = self.board
-		screen.clear()
+		size = self.term_size()
+		screen.begin(size.lines, size.columns)
+		view_cols, view_rows = self.view_size()
+		x0, y0 = self.update_camera(view_cols, view_rows)
+		x1, y1 = x0 + view_cols, y0 + view_rows
+		offset = 1
 		
+		fov = self.player.fov
+		if self.player.has_effect("Clairvoyance"):
+			fov = fov.copy()
+			for point in self.board.get_in_circle((self.player.x, self.player.y), 8):
+				x, y = point
+				neighbors = [(x+1, y), (x-1, y), (x, y+1), (x, y-1), (x+1, y+1), (x+1, y-1), (x-1, y+1), (x-1, y-1)]
+				surrounded = True
+				for xp, yp in neighbors:
+					if not self.board.in_bounds(xp, yp):
+						continue
+					if not board.blocks_sight(xp, yp):
+						surrounded = False
+						break
+				if not surrounded:
+					fov.add(point)
+		
+		view = (x0, y0, view_cols, view_rows)
+		last = self.drawn
+		full = screen.full or last is None or last[0] is not board or last[1] != view or board.redraw is None
+		if full:
+			dirty = None
+			seen = fov
+		else:
+			last_fov, marks = last[2], last[3]
+			dirty = set(marks)
+			if fov is last_fov:
+				seen = ()
+			else:
+				changed = fov ^ last_fov
+				seen = changed & fov
+				dirty |= changed
+			cols = board.cols
+			for index in board.redraw:
+				dirty.add((index % cols, index // cols))
+		board.redraw = set()
+		for point in seen:
+			board.reveal(*point)
+				
+		#The status line, sidebar and messages are only drawn again when they change
 		p = self.player
 		hp_str = f"HP {p.HP}/{p.get_max_hp()}"
 		c = 0
 		if p.HP <= p.get_max_hp()//8:
-			c = curses.color_pair(1) | curses.A_BOLD
+			c = self.color(1) | curses.A_BOLD
 		elif p.HP <= p.get_max_hp()//4:
-			c = curses.color_pair(3) 
-		width = get_terminal_size().columns
-		screen.addstr(0, 0, hp_str, c)
+			c = self.color(3) 
+		width = size.columns
+		chrome = [(0, 0, hp_str, c)]
 		dr = ""
 		if p.hp_drain > 0:
 			extent = p.hp_drain//10+1
 			dr = f" (Drain {extent})" 
-		screen.addstr(0, len(hp_str), f"{dr} | DG. LV {self.level} | XP {p.exp}/{p.max_exp()} ({p.level})")
-		wd = min(width, 60)
+		chrome.append((0, len(hp_str), f"{dr} | DG. LV {self.level} | XP {p.exp}/{p.max_exp()} ({p.level})", 0))
+		wd = min(width, max(60, view_cols + SIDEBAR_WIDTH))
+		def sidebar(y, string, attr=0):
+			chrome.append((y, wd - len(string), string, attr))
 		str_string = f"STR {p.STR}"
-		screen.addstr(0, wd - len(str_string), str_string, self._stat_mod_color(p.mod_str))
+		sidebar(0, str_string, self._stat_mod_color(p.mod_str))
 		dex_string = f"DEX {p.DEX}"
-		screen.addstr(1, wd - len(dex_string), dex_string, self._stat_mod_color(p.mod_dex))
+		sidebar(1, dex_string, self._stat_mod_color(p.mod_dex))
 		dmgdice = p.weapon.dmg
 		X = dmgdice.num
 		Y = dmgdice.sides
 		w = f"{p.weapon.non_ench_name} ({X}d{Y})"
-		screen.addstr(2, wd - len(w), w)
+		sidebar(2, w)
 		armor = self.player.armor
 		if armor:
 			ar_str = f"{armor.name} ({armor.protect})"
-			screen.addstr(3, wd - len(ar_str), ar_str)
+			sidebar(3, ar_str)
 		detect = p.detectability()
 		if detect is not None:
 			stealth = round(1/max(detect, 0.01) - 1, 1)
 			det_str = f"{stealth} stealth"
-			screen.addstr(4, wd - len(det_str), det_str)
-		
-		
-		fov = self.player.fov.copy()
-		if self.player.has_effect("Clairvoyance"):
-			for point in self.board.get_in_circle((self.player.x, self.player.y), 8):
-				x, y = point
-				neighbors = [(x+1, y), (x-1, y), (x, y+1), (x, y-1), (x+1, y+1), (x+1, y-1), (x-1, y+1), (x-1, y-1)]
-				surrounded = True
-				for xp, yp in neighbors:
-					if not self.board.in_bounds(xp, yp):
-						continue
-					if not board.blocks_sight(xp, yp):
-						surrounded = False
-						break
-				if not surrounded:
-					fov.add(point)
-					
-		for point in fov:
-			tile = board.get(*point)
-			if not tile.revealed:
-				tile.revealed = True
-				self.revealed.append(point)
-		offset = 1
-		marked = set()
-		for col, row in self.revealed:
-			tile = board.get(col, row)
-			s = tile.symbol
+			sidebar(4, det_str)
+		max_lines = min(MESSAGE_LINES, size.lines - (view_rows + 2))
+		messages = list(islice(self.msg_list, self.msg_cursor, self.msg_cursor+max_lines))
+		for i, msg in enumerate(messages):
+			message, color = msg
+			c = self.color(color)
+			if color == 1:
+				c |= curses.A_BOLD
+			if i == len(messages) - 1 and self.msg_cursor < max(0, len(self.msg_list) - max_lines):
+				message += " (↓)"
+			chrome.append((view_rows + i + offset + 1, 0, message, c))
+			
+		#Where the player, a blast or a projectile are drawn this frame needs drawing again next frame, as does any
+		#part of the map that the sidebar runs into (the map is drawn over it)
+		marks = {(self.player.x, self.player.y)}
+		marks |= self.blast
+		if self.projectile:
+			marks.add(self.projectile)
+		for y, x, string, attr in chrome:
+			if offset <= y < view_rows + offset:
+				for col in range(max(x, 0), min(x + len(string), view_cols)):
+					marks.add((col + x0, y - offset + y0))
+		revealed = board.revealed
+		cols = board.cols
+		if full:
+			def cells():
+				for row in range(y0, y1):
+					base = row * cols
+					end = base + x1
+					index = revealed.find(1, base + x0, end)
+					while index != -1:
+						yield index - base, row
+						index = revealed.find(1, index + 1, end)
+			cells = cells()
+		else:
+			dirty |= marks
+			cells = []
+			for x, y in dirty:
+				if x0 <= x < x1 and y0 <= y < y1:
+					if revealed[x + y * cols]:
+						cells.append((x, y))
+					else: #Nothing is drawn there, apart from the sidebar or a blast drawn again below
+						screen.addch(y - y0 + offset, x - x0, " ")
+		if screen.full: #Already blank
+			redraw = chrome
+		elif full:
+			for y in range(size.lines):
+				screen.clear(y)
+			redraw = chrome
+		elif chrome != last[4]: #Nothing else is drawn outside of the map
+			for y, x, string, attr in last[4]:
+				screen.clear(y, x, x + len(string))
+			redraw = chrome
+		else: #Only the parts of the sidebar over the map, which were just cleared
+			redraw = [part for part in chrome if offset <= part[0] < view_rows + offset and part[1] < view_cols]
+		for y, x, string, attr in redraw:
+			screen.addstr(y, x, string, attr)
+		
+		terrain = board.terrain
+		items = board.items
+		player = (self.player.x, self.player.y)
+		blast = self.blast
+		projectile = self.projectile
+		for pos in cells:
+			col, row = pos
+			index = col + row * cols
+			s = TERRAIN[terrain[index]].symbol
+			cell_items = items.get(index)
 			color = 0
-			if (col, row) == (self.player.x, self.player.y):
+			if pos == player:
 				s = "P"
 				if not self.player.has_effect("Invisible"):
 					color = curses.A_REVERSE
 				else:
-					color = curses.color_pair(4)
-			elif tile.items:
-				item = tile.items[-1]
+					color = self.color(4)
+			elif cell_items:
+				item = cell_items[-1]
 				s = item.symbol
-				color = curses.color_pair(2)
+				color = self.color(2)
 				if isinstance(item, (Scroll, Armor)):
-					color = curses.color_pair(4) | curses.A_BOLD
+					color = self.color(4) | curses.A_BOLD
 				elif isinstance(item, Wand):
-					color = curses.color_pair(5) | curses.A_BOLD
+					color = self.color(5) | curses.A_BOLD
 				elif isinstance(item, Weapon):
-					color = curses.color_pair(5) | curses.A_REVERSE
-			elif tile.symbol == " ":
-				if (col, row) in fov:
+					color = self.color(5) | curses.A_REVERSE
+			elif s == " ":
+				if pos in fov:
 					s = "."
-				if self.projectile:
-					x, y = self.projectile
-					if (col, row) == (x, y):
-						s = "*"
-			if (col, row) in self.blast:
-				color = curses.color_pair(2)
+				if pos == projectile:
+					s = "*"
+			if pos in blast:
+				color = self.color(2)
 				color |= curses.A_REVERSE
-				marked.add((col, row))
-			try:
-				screen.addstr(row + offset, col, s, color)
-			except curses.error:
-				pass
-		monpos = set()
+			screen.addch(row - y0 + offset, col - x0, s, color)
 		for m in self.monsters:
 			x, y = m.x, m.y
-			if (x, y) in fov:
-				monpos.add((x, y))
-				color = curses.color_pair(3) if m.ranged else 0
+			if (x, y) in fov and x0 <= x < x1 and y0 <= y < y1:
+				marks.add((x, y))
+				color = self.color(3) if m.ranged else 0
 				if m.has_effect("Confused"):
-					color = curses.color_pair(4)
+					color = self.color(4)
 				elif m.has_effect("Stunned"):
-					color = curses.color_pair(5)
+					color = self.color(5)
 				elif not m.is_aware:
 					if m.has_effect("Asleep"):
-						color = curses.color_pair(4)
+						color = self.color(4)
 					color |= curses.A_REVERSE
 				elif m.is_friendly():
-					color = curses.color_pair(6)
+					color = self.color(6)
 				if m is self.select or (m.x, m.y) in self.blast:
-					color = curses.color_pair(2)
+					color = self.color(2)
 					color |= curses.A_REVERSE
-				try:
-					screen.addstr(y+offset, x, m.symbol, color)
-				except curses.error:
-					pass
-		for x, y in (self.blast - monpos - marked):
-			if not self.board.in_bounds(x, y):
+				screen.addch(y - y0 + offset, x - x0, m.symbol, color)
+		for x, y in self.blast:
+			if not (x0 <= x < x1 and y0 <= y < y1) or revealed[x + y * cols]:
 				continue
-			try:
-				screen.addstr(y+offset, x, " ", curses.color_pair(2) | curses.A_REVERSE)
-			except curses.error:
-				pass
+			screen.addch(y - y0 + offset, x - x0, " ", self.color(2) | curses.A_REVERSE)
+		self.drawn = (board, view, fov, marks, chrome)
 		
-		max_lines = self.get_max_lines()
-		messages = list(islice(self.msg_list, self.msg_cursor, self.msg_cursor+self.get_max_lines()))
-		for i, msg in enumerate(messages):
-			message, color = msg
-			c = curses.color_pair(color)
-			if color == 1:
-				c |= curses.A_BOLD
-			if i == len(messages) - 1 and self.msg_cursor < max(0, len(self.msg_list) - self.get_max_lines()):
-				message += " (↓)"
-			try:
-				screen.addstr(board.rows + i + offset + 1, 0, message, c)
-			except:
-				pass
-		
-		try:
-			screen.move(board.rows + offset, 0)
-		except curses.error:
-			pass
-		screen.refresh()
+		screen.present(cursor=(view_rows + offset, 0))
 		
 	def _stat_mod_color(self, mod):
 		if mod > 0:
-			return curses.color_pair(2)
+			return self.color(2)
 		if mod < 0:
-			return curses.color_pair(1)
+			return self.color(1)
 		return 0
 		
 	def refresh_cache(self):
@@ -605,18 +850,65 @@ class Game:
 		for m in self.monsters[:]:
 			board.set_cache(m.x, m.y, m)  
 		
+	def fast_forward(self, batch=FAST_FORWARD_BATCH):
+		"""
+		Runs up to the given number of turns of the player resting or doing an activity, without drawing anything.
+		Stops early once the rest or activity is over, either because it's done, or because it was interrupted
+		(e.g. by taking damage, or by a monster coming into view).
+		Returns the number of turns that were run.
+		"""
+		player = self.player
+		seen = set(player.monsters_in_fov())
+		turns = 0
+		while turns < batch and not player.dead:
+			if player.resting:
+				player.energy = 0
+				if player.HP >= player.get_max_hp():
+					self.print_msg("HP restored.", "green")
+					player.resting = False
+					player.energy = random.randint(1, player.get_speed())
+					self.save_game()
+					break
+			elif player.activity:
+				player.energy = 0
+				player.activity.time -= 1
+				if player.activity.time <= 0:
+					player.activity.on_finished(player)
+					player.activity = None
+					player.energy = random.randint(1, player.get_speed())
+					self.save_game()
+					break
+			else:
+				break
+			self.do_turn()
+			turns += 1
+			for m in player.monsters_in_fov():
+				if m not in seen:
+					seen.add(m)
+					if player.resting or player.activity:
+						self.print_msg(f"You see a {m.name}.", "yellow")
+						player.interrupt()
+		self.autosave()
+		return turns
+		
+	@uses_stream("ai")
 	def do_turn(self):
 		while self.player.energy <= 0:
 			if one_in(10): #In case anything goes wrong, refresh the monster collision cache every so often
 				self.refresh_cache()
+			sched = self.scheduler
+			sched.wake_due(self.player.ticks + 1)
+			sched.wake_visible(self.player.fov, self.board, self.player.ticks + 1)
+			if self.stairs_pending:
+				self.player.place_stairs()
 			self.player.do_turn()
-			order = self.monsters[:]
-			random.shuffle(order)
-			order.sort(key=lambda m: m.get_speed(), reverse=True)
+			order = sched.turn_order()
 			self.player.energy += self.player.get_speed()		
 			for m in order:
 				if m.HP > 0:
 					m.do_turn()
+					if m.HP > 0 and (wake := m.dormant_until(self.player.ticks)) is not None:
+						sched.park(m, wake, self.player.ticks)
 				else:
 					self.remove_monster(m)
 				if self.player.dead:
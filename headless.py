@@ -0,0 +1,71 @@
+#Headless backend
+#Lets a Game run without a terminal (for batch runs, benchmarks and servers): HeadlessScreen stands in for the
+#curses window, keeping what would have been drawn in memory and reading keystrokes from a script.
+import os
+
+class ScriptExhausted(Exception):
+	"Raised when a headless game asks for input after its scripted keys have run out"
+
+class HeadlessScreen:
+	
+	def __init__(self, keys=(), lines=40, columns=100):
+		self.lines = lines
+		self.columns = columns
+		self.keys = iter(keys)
+		self.no_delay = False
+		self.cursor = (0, 0)
+		self.clear()
+	
+	def size(self):
+		return os.terminal_size((self.columns, self.lines))
+	
+	def getmaxyx(self):
+		return self.lines, self.columns
+	
+	def clear(self):
+		self.chars = [[" "] * self.columns for _ in range(self.lines)]
+		self.attrs = [[0] * self.columns for _ in range(self.lines)]
+	
+	erase = clear
+	
+	def addstr(self, y, x, string, attr=0):
+		if not (0 <= y < self.lines):
+			return
+		chars = self.chars[y]
+		attrs = self.attrs[y]
+		for c in string:
+			if 0 <= x < self.columns:
+				chars[x] = c
+				attrs[x] = attr
+			x += 1
+	
+	def move(self, y, x):
+		self.cursor = (y, x)
+	
+	def refresh(self):
+		pass
+	
+	def noutrefresh(self):
+		pass
+	
+	def nodelay(self, flag):
+		self.no_delay = flag
+	
+	def getch(self):
+		if self.no_delay: #Scripted keys are only handed out when the game is waiting for one
+			return -1
+		try:
+			key = next(self.keys)
+		except StopIteration:
+			raise ScriptExhausted("Ran out of scripted keys") from None
+		return ord(key) if isinstance(key, str) else key
+	
+	def getstr(self):
+		chars = []
+		while (c := self.getch()) != 10:
+			chars.append(chr(c))
+		return "".join(chars).encode()
+	
+	def text(self):
+		"Returns what is currently on the screen, one string per line"
+		return ["".join(row).rstrip() for row in self.chars]
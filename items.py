@@ -1,5 +1,6 @@
 
-import random, time
+import time
+from rng import random
 from utils import *
 
 class Item:
@@ -234,9 +235,8 @@ class SummonScroll(Scroll):
 				continue
 			m = typ(g)
 			m.ranged = False
-			m.place_at(*pos)
 			m.summon_timer = duration
-			g.monsters.append(m)
+			g.add_monster_at(m, pos)
 			ind += random.randint(1, 2)
 			num -= 1
 		return True
@@ -522,9 +522,9 @@ class Wand(Item):
 		if not target:
 			return
 		if g.board.line_of_sight((player.x, player.y), (target.x, target.y)):
-			line = list(g.board.line_between((player.x, player.y), (target.x, target.y)))
+			line = list(g.board.get_line((player.x, player.y), (target.x, target.y)))
 		else:
-			line = list(g.board.line_between((target.x, target.y), (player.x, player.y)))
+			line = list(g.board.get_line((target.x, target.y), (player.x, player.y)))
 			line.reverse()
 		if self.efftype == "ray":
 			t = player.distance(target)
@@ -561,15 +561,15 @@ class Wand(Item):
 						t.on_alerted()
 				g.blast.add((x, y))
 				g.draw_board()
-				time.sleep(0.001)
-			time.sleep(0.05)
+				g.delay(0.001)
+			g.delay(0.05)
 			g.blast.clear()
 			g.draw_board()
 		else:
 			for x, y in line:
 				g.set_projectile_pos(x, y)
 				g.draw_board()
-				time.sleep(0.03)
+				g.delay(0.03)
 				if (t := g.get_monster(x, y)) is not None:
 					if t is not target and x_in_y(3, 5): #If a creature is in the way, we may hit it instead of our intended target.
 						g.print_msg(f"The {t.name} is in the way.")
@@ -1,4 +1,5 @@
-import random, time
+import time
+from rng import random, uses_stream
 from utils import *
 from entity import Entity
 from items import *
@@ -21,6 +22,12 @@ class Attack:
 	
 symbols = {}
 dup_warnings = []
+
+#Unaware monsters further than this from the player (or asleep for at least DORMANT_MIN_SLEEP ticks) and out of view
+#are parked by the scheduler, and only looked at again every DORMANT_RECHECK ticks (or when they come into view)
+DORMANT_RANGE = 15
+DORMANT_MIN_SLEEP = 10
+DORMANT_RECHECK = 10
 								
 class Monster(Entity):
 	min_level = 1
@@ -84,6 +91,8 @@ class Monster(Entity):
 	def get_speed(self):
 		speed = self.speed
 		#When effects modify speed, the effects will go here
+		#The scheduler keeps monsters in buckets by speed, so it's told whenever a monster's effects change (see gain_effect,
+		#lose_effect and tick_effects)
 		return speed
 		
 	def reset_check_timer(self):
@@ -130,6 +139,7 @@ class Monster(Entity):
 		oldname = self.name
 		typ = self.choose_polymorph_type()
 		self.__class__ = typ
+		self.g.scheduler.update(self) #The new form may have a different speed
 		inst = typ(self.g)
 		self.ranged = False
 		self._symbol = inst.symbol
@@ -157,6 +167,7 @@ class Monster(Entity):
 		if name not in self.effects:
 			self.effects[name] = 0
 		self.effects[name] += duration
+		self.g.scheduler.update(self)
 		if self.incapacitated():
 			player = self.g.player
 			player.remove_grapple(self)
@@ -164,6 +175,7 @@ class Monster(Entity):
 	def lose_effect(self, name):
 		if name in self.effects:
 			del self.effects[name]
+			self.g.scheduler.update(self)
 			
 	def despawn_summon(self):
 		if self.summon_timer is None:
@@ -193,19 +205,20 @@ class Monster(Entity):
 				self.energy = min(self.energy, 0) 
 		self.tick_effects()
 			
-	def tick_effects(self):
+	def tick_effects(self, ticks=1):
 		if self.summon_timer is not None and self.summon_timer > 0:
-			self.summon_timer -= 1
+			self.summon_timer = max(self.summon_timer - ticks, 0)
 			if self.summon_timer == 0:
 				self.despawn()
 				self.g.print_msg_if_sees((self.x, self.y), "Your summoned ally disappears!")
 				return
 		if self.track_timer > 0:
-			self.track_timer -= 1
+			self.track_timer = max(self.track_timer - ticks, 0)
 		for e in list(self.effects.keys()):
-			self.effects[e] -= 1
+			self.effects[e] -= ticks
 			if self.effects[e] <= 0:
 				del self.effects[e]
+				self.g.scheduler.update(self)
 				if e == "Confused":
 					self.g.print_msg_if_sees((self.x, self.y), f"The {self.name} is no longer confused.")
 				elif e == "Stunned":
@@ -217,6 +230,56 @@ class Monster(Entity):
 					self.energy -= self.get_speed()
 					self.target = self.g.player
 				
+	def dormant_until(self, tick):
+		"""
+		If this monster can sit out the next several ticks without anything noticeable happening, returns the tick
+		at which it should wake up again. Otherwise, returns None.
+		"""
+		player = self.g.player
+		if self.is_aware or self.last_seen is not None or self.is_friendly():
+			return None
+		if self.target is not None and self.target is not player:
+			return None
+		if (self.x, self.y) in player.fov:
+			return None
+		asleep = self.effects.get("Asleep", 0)
+		if asleep >= DORMANT_MIN_SLEEP:
+			return tick + asleep
+		if self.distance(player) > DORMANT_RANGE:
+			return tick + DORMANT_RECHECK
+		return None
+		
+	def catch_up(self, ticks):
+		"Applies the ticks missed while dormant all at once"
+		if ticks <= 0:
+			return
+		self.check_timer -= ticks
+		if self.check_timer <= 0:
+			self.reset_check_timer()
+		#Monsters don't move while they're incapacitated, so only the ticks after that are walked
+		incapacitated = max(self.effects.get(e, 0) for e in ("Asleep", "Stunned", "Paralyzed"))
+		self.catch_up_wandering(ticks - incapacitated)
+		self.tick_effects(ticks)
+		
+	def catch_up_wandering(self, ticks):
+		"""
+		Takes the wandering steps a dormant monster would have taken over the given number of ticks, the same way as
+		do_turn and actions would have, so that monsters far from the player keep moving around while they're parked.
+		Stops once the monster comes into view, at which point it's woken up as normal.
+		"""
+		fov = self.g.player.fov
+		speed = self.get_speed()
+		for _ in range(ticks):
+			self.energy += speed
+			while self.energy > 0:
+				if (self.x, self.y) in fov:
+					return
+				old = self.energy
+				if not one_in(5):
+					self.wander()
+				if self.energy == old:
+					self.energy = min(self.energy, 0)
+				
 	def should_use_ranged(self):
 		board = self.g.board
 		player = self.g.player
@@ -245,6 +308,7 @@ class Monster(Entity):
 			damage = binomial(damage, 50)
 		return max(damage, 0)
 		
+	@uses_stream("combat")
 	def melee_attack(self, target=None, attack=None, force=False):
 		if attack is None:
 			attacks = list(filter(lambda a: isinstance(a, list) or a.can_use(self, self.g.player), self.attacks))
@@ -318,6 +382,7 @@ class Monster(Entity):
 	def saving_throw(self, stat, DC):
 		return dice(1, 20) + calc_mod(stat) >= DC
 		
+	@uses_stream("combat")
 	def do_ranged_attack(self, target=None):
 		if not self.ranged:
 			return
@@ -330,7 +395,7 @@ class Monster(Entity):
 		for point in board.line_between((self.x, self.y), (target.x, target.y), skipfirst=True, skiplast=True):
 			self.g.set_projectile_pos(*point)
 			self.g.draw_board()
-			time.sleep(0.06)
+			self.g.delay(0.06)
 		self.g.clear_projectile()
 		roll = dice(1, 20)
 		if (target is player and player.has_effect("Invisible")) or self.has_effect("Frightened"): #The player is harder to hit when invisible
@@ -394,7 +459,7 @@ class Monster(Entity):
 				continue
 			xp = self.x + dx
 			yp = self.y + dy
-			if (xp < 0 or xp >= board.cols) or (yp < 0 or yp >= board.cols):
+			if (xp < 0 or xp >= board.cols) or (yp < 0 or yp >= board.rows):
 				continue
 			if board.blocks_sight(xp, yp) or not board.line_of_sight((self.x, self.y), (xp, yp)):
 				tries -= 1
@@ -402,6 +467,27 @@ class Monster(Entity):
 				self.last_seen = (xp, yp)
 				break
 				
+	def approach_player(self):
+		"Takes a step towards the player by walking downhill on the shared approach map. Returns True if we moved."
+		board = self.g.board
+		dist = self.g.get_approach_map()
+		cols = board.cols
+		here = dist.get(self.x + self.y * cols, -1)
+		if here <= 0:
+			return False
+		steps = []
+		for dx, dy in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
+			x, y = self.x + dx, self.y + dy
+			if not board.in_bounds(x, y):
+				continue
+			d = dist.get(x + y * cols, -1)
+			if 0 <= d < here and board.is_passable(x, y):
+				steps.append((dx, dy))
+		if not steps:
+			return False #Every step downhill is blocked by a monster; the caller can route around them instead
+		self.clear_path()
+		return self.move(*random.choice(steps))
+		
 	def reset_track_timer(self):
 		self.track_timer = random.randint(25, 65)
 	
@@ -443,13 +529,12 @@ class Monster(Entity):
 		m2.HP = m2.MAX_HP = hp2
 		self.g.print_msg(f"The {self.name} splits into two!", "yellow")
 		self.despawn()
-		m1.place_at(x, y)
-		m2.place_at(nx, ny)
-		g.monsters.append(m1)
-		g.monsters.append(m2)
+		g.add_monster_at(m1, (x, y))
+		g.add_monster_at(m2, (nx, ny))
 			
 	def on_alerted(self, target=None):
 		player = self.g.player
+		self.g.scheduler.wake(self, player.ticks + 1)
 		self.is_aware = True
 		if target is not None and target is not player:
 			self.target = None
@@ -604,7 +689,8 @@ class Monster(Entity):
 					used_spell = self.try_use_spell(target)
 				if not used_spell:
 					oldx, oldy = self.x, self.y
-					self.path_towards(target.x, target.y)
+					if target is not player or not self.approach_player():
+						self.path_towards(target.x, target.y)
 					moved = (self.x, self.y) != (oldx, oldy)
 					if not moved and self.distance(target) <= 4 and one_in(5):
 						could_route_around = self.g.monster_at(self.x+dx, self.y) or self.g.monster_at(self.x, self.y+dy)
@@ -633,30 +719,34 @@ class Monster(Entity):
 				else:
 					self.stop_tracking()
 			elif not one_in(5):
-				choose_new = self.dir is None or (one_in(3) or not self.move(*self.dir))
-				if choose_new:
-					if self.dir is None:
-						dirs = [(-1, 0), (1, 0), (0, 1), (0, -1)]
-						random.shuffle(dirs)
-						for d in dirs:
-							if self.move(*d):
-								self.dir = d
-								break
-					else:
-						if self.dir in [(-1, 0), (1, 0)]:
-							dirs = [(0, 1), (0, -1)]
-						else:
-							dirs = [(-1, 0), (1, 0)]
-						random.shuffle(dirs)
-						for d in dirs:
-							if self.move(*d):
-								self.dir = d
-								break
-						else:
-							if not self.move(*self.dir):
-								d = (-self.dir[0], -self.dir[1])
-								self.move(*d)
-								self.dir = d
+				self.wander()
+				
+	def wander(self):
+		"Takes a step while wandering around unaware, mostly keeping to the same direction"
+		choose_new = self.dir is None or (one_in(3) or not self.move(*self.dir))
+		if choose_new:
+			if self.dir is None:
+				dirs = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+				random.shuffle(dirs)
+				for d in dirs:
+					if self.move(*d):
+						self.dir = d
+						break
+			else:
+				if self.dir in [(-1, 0), (1, 0)]:
+					dirs = [(0, 1), (0, -1)]
+				else:
+					dirs = [(-1, 0), (1, 0)]
+				random.shuffle(dirs)
+				for d in dirs:
+					if self.move(*d):
+						self.dir = d
+						break
+				else:
+					if not self.move(*self.dir):
+						d = (-self.dir[0], -self.dir[1])
+						self.move(*d)
+						self.dir = d
 					
 	def maybe_use_spell(self, spell, target):
 		if self.distance(target, False) > spell.range:
@@ -675,9 +765,9 @@ class Monster(Entity):
 			spell.on_hit_effect(self, target)
 			return True
 		if g.board.line_of_sight((self.x, self.y), (target.x, target.y)):
-			line = list(g.board.line_between((self.x, self.y), (target.x, target.y)))
+			line = list(g.board.get_line((self.x, self.y), (target.x, target.y)))
 		elif g.board.line_of_sight((target.x, target.y), (self.x, self.y)):
-			line = list(g.board.line_between((target.x, target.y), (self.x, self.y)))
+			line = list(g.board.get_line((target.x, target.y), (self.x, self.y)))
 			line.reverse()
 		else:
 			return False
@@ -691,7 +781,7 @@ class Monster(Entity):
 			for x, y in line:
 				 g.set_projectile_pos(x, y)
 				 g.draw_board()
-				 time.sleep(0.03)
+				 g.delay(0.03)
 			g.clear_projectile()
 			spell.on_hit_effect(self, target)
 		elif spell.efftype == "cone":
@@ -718,7 +808,7 @@ class Monster(Entity):
 				elif (player.x, player.y) == (cx, cy):
 					spell.on_hit_effect(self, player)
 			g.draw_board()
-			time.sleep(0.2)
+			g.delay(0.2)
 			g.blast.clear()
 			g.draw_board()
 			return True
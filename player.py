@@ -1,10 +1,11 @@
-import random, time, math
+import time, math
+from rng import random
 from collections import defaultdict
 from utils import *
 
 from entity import Entity
+from board import STAIR
 from items import *
-from os import get_terminal_size
 
 class Player(Entity):
 	
@@ -220,26 +221,23 @@ class Player(Entity):
 	def rand_place(self):
 		self.x = 0
 		self.y = 0
+		self.placed = False #The board is new, so we aren't in its monster collision cache yet
 		if not super().place_randomly():
 			raise RuntimeError("Could not generate a valid starting position for player")
 	
 	def teleport(self):
 		board = self.g.board
 		oldloc = (self.x, self.y)
-		for _ in range(500):
-			x = random.randint(1, board.cols - 2)
-			y = random.randint(1, board.rows - 2)
-			if board.is_passable(x, y) and (x, y) != oldloc:
-				seeslastpos = board.line_of_sight((x, y), oldloc)
-				if not seeslastpos: #We teleported out of sight
-					for m in self.monsters_in_fov():
-						m.track_timer = min(m.track_timer, dice(1, 7)) #Allow them to still close in on where they last saw you, and not immediately realize you're gone
-				self.g.print_msg("You teleport!")
-				self.x = x
-				self.y = y
-				self.fov = self.calc_fov()
-				self.grappled_by.clear()
-				break
+		pos = board.random_free_cell() #Never where we are, since we're in the monster collision cache
+		if pos and pos != oldloc:
+			seeslastpos = board.line_of_sight(pos, oldloc)
+			if not seeslastpos: #We teleported out of sight
+				for m in self.monsters_in_fov():
+					m.track_timer = min(m.track_timer, dice(1, 7)) #Allow them to still close in on where they last saw you, and not immediately realize you're gone
+			self.g.print_msg("You teleport!")
+			self.place_at(*pos)
+			self.fov = self.calc_fov()
+			self.grappled_by.clear()
 		else:
 			self.g.print_msg("You feel yourself begin to teleport, but nothing happens.")
 	
@@ -322,11 +320,10 @@ class Player(Entity):
 		speed = self.get_speed()
 		board = self.g.board
 		if dx != 0 or dy != 0:
-			tile = board.get(self.x, self.y)
-			if not tile.walked:
-				tile.walked = True
-				if tile.items:
-					strings = list(map(lambda item: item.name, tile.items))
+			if board.walk(self.x, self.y):
+				items = board.items_at(self.x, self.y)
+				if items:
+					strings = list(map(lambda item: item.name, items))
 					if len(strings) == 1:
 						self.g.print_msg(f"You see a {strings[0]} here.")
 					else:
@@ -458,7 +455,7 @@ class Player(Entity):
 			dist += 1
 			self.move_to(x, y)
 			self.g.draw_board()
-			time.sleep(0.01)
+			self.g.delay(0.01)
 		
 		
 	def throw_item(self, item):
@@ -522,14 +519,14 @@ class Player(Entity):
 		if c and c[0].lower() == "c":
 			return
 		if g.board.line_of_sight((self.x, self.y), (target.x, target.y)):
-			line = list(g.board.line_between((self.x, self.y), (target.x, target.y)))
+			line = list(g.board.get_line((self.x, self.y), (target.x, target.y)))
 		else:
-			line = list(g.board.line_between((target.x, target.y), (self.x, self.y)))
+			line = list(g.board.get_line((target.x, target.y), (self.x, self.y)))
 			line.reverse()
 		for x, y in line:
 			g.set_projectile_pos(x, y)
 			g.draw_board()
-			time.sleep(0.03)
+			g.delay(0.03)
 		g.clear_projectile()
 		roll = dice(1, 20)
 		crit = False
@@ -682,7 +679,7 @@ class Player(Entity):
 		for e in list(self.effects.keys()):
 			self.adjust_duration(e, -1)
 		mod = self.stealth_mod()
-		for m in self.g.monsters:
+		for m in self.g.scheduler.active(): #Dormant monsters are never in view, and catch up on their check timers when they wake
 			m.check_timer -= 1
 			if m.check_timer <= 0 or self.did_attack or one_in(25): #Very occasionally make the check before the timer reaches zero
 				m.reset_check_timer()
@@ -882,29 +879,49 @@ class Player(Entity):
 		if num == 0:
 			if self.g.level == 1:
 				self.g.print_msg("Level complete! Move onto the stairs marked with a \">\", then press SPACE to go down to the next level.")
-			board = self.g.board
-			los_tries = 100
-			while True:
-				sx = random.randint(1, board.cols - 2)
-				sy = random.randint(1, board.rows - 2)
-				if not board.is_passable(sx, sy):
-					continue
-				if los_tries > 0 and board.line_of_sight((self.x, self.y), (sx, sy)):
-					los_tries -= 1
-					continue
-				if abs(self.x - sx) + abs(self.y - sy) <= 4:
-					continue
-				tile = board.get(sx, sy)
-				if tile.items:
-					continue
-				tile.symbol = ">"
-				tile.stair = True
-				break
+			self.place_stairs()
+			
+	def place_stairs(self):
+		"Puts down the stairs once the level is cleared. If there's nowhere to put them, tries again on the next turn."
+		pos = self.stair_position()
+		self.g.stairs_pending = pos is None
+		if pos is not None:
+			self.g.board.set_terrain(*pos, STAIR)
+				
+	def stair_position(self):
+		"""
+		Picks where to put the stairs once the level is cleared: preferably in a room other than the one we're in and
+		out of sight, and not right next to us unless there's nowhere else left. Returns None if every cell is taken.
+		"""
+		board = self.g.board
+		graph = board.room_graph()
+		here = graph.room_at(self.x, self.y)
+		rooms = [r for r in range(len(graph.rooms)) if r != here]
+		random.shuffle(rooms)
+		def suitable(pos, hidden):
+			sx, sy = pos
+			if abs(self.x - sx) + abs(self.y - sy) <= 4:
+				return False
+			return not hidden or not board.line_of_sight((self.x, self.y), pos)
+		for hidden in (True, False):
+			for room in rooms:
+				pos = graph.random_cell(room)
+				if board.is_passable(*pos) and not board.items_at(*pos) and suitable(pos, hidden):
+					return pos
+		#No room had a spot (or the level's rooms aren't known), so look anywhere on the board
+		for hidden in (True, False):
+			for _ in range(100):
+				pos = board.random_free_cell(no_items=True)
+				if pos is None:
+					break
+				if suitable(pos, hidden):
+					return pos
+		return board.random_free_cell(no_items=True)
 	
 	def inventory_menu(self):
 		from gameobj import GameTextMenu
 		menu = GameTextMenu(self.g)
-		max_lines = get_terminal_size().lines	
+		max_lines = self.g.term_size().lines	
 		scroll = 0
 		items = self.inventory[:]
 		d = {}
@@ -938,7 +955,7 @@ class Player(Entity):
 			num_display = min(len(chars), max_lines - 4)
 			scroll_limit = max(0, len(strings) - num_display)
 			n = min(len(strings), num_display)
-			padsize = min(30, get_terminal_size().columns)
+			padsize = min(30, self.g.term_size().columns)
 			for i in range(n):
 				string = strings[i+scroll].ljust(padsize)
 				if i == 0 and scroll > 0:
@@ -0,0 +1,181 @@
+#Turn profiling
+#Opt-in instrumentation for finding out where the time goes within a turn. When turned on, the functions making up
+#each phase of a turn (see PHASES) are wrapped with timers, and every call is recorded into a histogram of how long it
+#took. Calls into monster code are also counted per monster class.
+#Nothing is patched unless profiling is turned on, so it costs nothing otherwise.
+#
+#Run the game with --profile to turn it on. The summary is written to profile.txt when the game ends, or whenever
+#"P" is pressed.
+import sys, time
+from collections import defaultdict
+from functools import wraps
+
+#(module, class name or None for a function, function name, phase name, whether to count calls per class)
+PHASES = [
+	("gameobj", "Game", "do_turn", "turn", False),
+	("player", "Player", "do_turn", "player.do_turn", False),
+	("monster", "Monster", "do_turn", "monster.do_turn", True),
+	("monster", "Monster", "actions", "monster.actions", True),
+	("board", None, "pathfind", "pathfind", False),
+	("roomgraph", "RoomGraph", "route", "route", False),
+	("entity", "Entity", "calc_fov", "calc_fov", False),
+	("gameobj", "Game", "draw_board", "draw_board", False),
+	("gameobj", "Game", "save_game", "save_game", False),
+]
+
+class PhaseStats:
+	"Call count, total and maximum time, and a histogram of times for one phase"
+	__slots__ = ("calls", "total", "max", "buckets")
+
+	def __init__(self):
+		self.calls = 0
+		self.total = 0 #Nanoseconds
+		self.max = 0
+		#Bucket 0 counts calls taking under 1µs; bucket i counts calls taking from 2**(i-1) up to 2**i µs
+		self.buckets = []
+
+	def add(self, ns):
+		self.calls += 1
+		self.total += ns
+		if ns > self.max:
+			self.max = ns
+		b = (ns // 1000).bit_length()
+		buckets = self.buckets
+		if b >= len(buckets):
+			buckets.extend([0] * (b + 1 - len(buckets)))
+		buckets[b] += 1
+
+	def percentile(self, p):
+		"Returns an upper bound on the time in µs that p percent of calls took no longer than"
+		needed = self.calls * p / 100
+		seen = 0
+		bound = 1 << len(self.buckets)
+		for b, count in enumerate(self.buckets):
+			seen += count
+			if seen >= needed:
+				bound = 1 << b
+				break
+		return min(bound, -(-self.max // 1000))
+
+class Profiler:
+
+	def __init__(self):
+		self.phases = defaultdict(PhaseStats)
+		self.class_calls = defaultdict(lambda: defaultdict(int)) #Phase -> class name -> number of calls
+		self.patched = [] #(owner, attribute, original) for everything replaced, so that it can be put back
+		self.started = time.perf_counter()
+
+	def wrap(self, func, phase, per_class=False):
+		stats = self.phases[phase]
+		counts = self.class_calls[phase]
+		clock = time.perf_counter_ns
+		if per_class:
+			@wraps(func)
+			def wrapper(obj, *args, **kwargs):
+				counts[type(obj).__name__] += 1
+				start = clock()
+				try:
+					return func(obj, *args, **kwargs)
+				finally:
+					stats.add(clock() - start)
+		else:
+			@wraps(func)
+			def wrapper(*args, **kwargs):
+				start = clock()
+				try:
+					return func(*args, **kwargs)
+				finally:
+					stats.add(clock() - start)
+		wrapper.__profiled__ = func
+		return wrapper
+
+	def _replace(self, owner, name, value):
+		self.patched.append((owner, name, owner.__dict__[name]))
+		setattr(owner, name, value)
+
+	def patch_method(self, cls, name, phase, per_class=False):
+		"Instruments a method, along with every override of it in a subclass"
+		classes = [cls]
+		for c in classes:
+			classes.extend(c.__subclasses__())
+		for c in dict.fromkeys(classes):
+			func = c.__dict__.get(name)
+			if func is not None and not hasattr(func, "__profiled__"):
+				self._replace(c, name, self.wrap(func, phase, per_class))
+
+	def patch_function(self, module, name, phase):
+		"Instruments a function, including in every module that imported it by name"
+		func = getattr(module, name)
+		wrapper = self.wrap(func, phase)
+		for mod in list(sys.modules.values()):
+			if getattr(mod, "__dict__", {}).get(name) is func:
+				self._replace(mod, name, wrapper)
+
+	def uninstall(self):
+		for owner, name, original in reversed(self.patched):
+			setattr(owner, name, original)
+		self.patched.clear()
+
+	def reset(self):
+		for stats in self.phases.values():
+			stats.__init__()
+		for counts in self.class_calls.values():
+			counts.clear()
+		self.started = time.perf_counter()
+
+	def summary(self):
+		"Returns the profile as a list of lines of text"
+		elapsed = time.perf_counter() - self.started
+		lines = [f"Profile over {elapsed:.1f}s", ""]
+		lines.append(f"{'phase':<16}{'calls':>9}{'total ms':>11}{'mean µs':>10}{'p50 µs':>9}{'p99 µs':>9}{'max µs':>10}")
+		for phase, stats in self.phases.items():
+			if not stats.calls:
+				continue
+			lines.append(f"{phase:<16}{stats.calls:>9}{stats.total / 1e6:>11.1f}{stats.total / stats.calls / 1000:>10.1f}"
+				f"{stats.percentile(50):>9}{stats.percentile(99):>9}{stats.max / 1000:>10.0f}")
+		for phase, stats in self.phases.items():
+			if not stats.calls:
+				continue
+			lines.append("")
+			lines.append(f"{phase} histogram:")
+			top = max(stats.buckets)
+			for b, count in enumerate(stats.buckets):
+				if count:
+					bound = "<1" if b == 0 else f"{1 << (b - 1)}-{1 << b}"
+					lines.append(f"  {bound:>14} µs {count:>8} {'#' * max(1, 40 * count // top)}")
+		for phase, counts in self.class_calls.items():
+			if not counts:
+				continue
+			lines.append("")
+			lines.append(f"{phase} calls by class:")
+			for name, count in sorted(counts.items(), key=lambda c: -c[1]):
+				lines.append(f"  {name:<20}{count:>9}")
+		return lines
+
+	def dump(self, path="profile.txt"):
+		with open(path, "w", encoding="utf-8") as f:
+			f.write("\n".join(self.summary()) + "\n")
+		return path
+
+current = None #The installed Profiler, if profiling is on
+
+def install():
+	"Turns profiling on, and returns the Profiler"
+	global current
+	if current is None:
+		import importlib
+		current = Profiler()
+		for module, cls, name, phase, per_class in PHASES:
+			mod = importlib.import_module(module)
+			if cls is None:
+				current.patch_function(mod, name, phase)
+			else:
+				current.patch_method(getattr(mod, cls), name, phase, per_class)
+	return current
+
+def uninstall():
+	"Turns profiling off, removing the instrumentation"
+	global current
+	if current is not None:
+		current.uninstall()
+		current = None
@@ -0,0 +1,145 @@
+#Incremental renderer
+#Frames are drawn into a back buffer of (character, attribute) cells instead of straight onto the screen. When the
+#frame is presented, it is compared against the previous one, and only the cells that changed are written out, in
+#runs of consecutive cells that share the same attribute.
+#The back buffer starts out as the previous frame, so a frame only has to draw the parts that changed. Its rows are
+#shared with the previous frame until they're drawn to, and only the cells that were drawn to are compared.
+import curses
+
+BLANK = (" ", 0)
+
+class Renderer:
+
+	def __init__(self, screen, update=None):
+		"""
+		screen - The window to draw to
+		update - Called after the window is updated to push the changes to the terminal (e.g. curses.doupdate)
+		"""
+		self.screen = screen
+		self.update = update
+		self.lines = 0
+		self.columns = 0
+		self.front = None #What is currently on the screen; None if unknown
+		self.back = []
+		self.full = True #Whether the current frame started out blank and has to be drawn in full
+		self.touched = {} #Row -> the columns drawn to in that row this frame (unless the frame is drawn in full)
+		self.frames = 0
+		self.cells_written = 0
+
+	def invalidate(self):
+		"Must be called when something else has drawn to the screen, so that the next frame is redrawn in full"
+		self.front = None
+
+	def begin(self, lines, columns):
+		"Starts a new frame with the given screen size, as a copy of the last one, or blank if the screen is unknown"
+		if (lines, columns) != (self.lines, self.columns):
+			self.lines = lines
+			self.columns = columns
+			self.front = None
+		self.full = self.front is None
+		if self.full:
+			self.back = [[BLANK] * columns for _ in range(lines)]
+		else:
+			self.back = self.front[:]
+		self.touched = {}
+
+	def _row(self, y):
+		"Returns row y of the back buffer, and the set of its columns that were drawn to this frame"
+		columns = self.touched.get(y)
+		if columns is None:
+			columns = self.touched[y] = set()
+			self.back[y] = self.back[y][:] #Until now, shared with the last frame
+		return self.back[y], columns
+
+	def clear(self, y, start=0, end=None):
+		"Blanks part of a row of the back buffer, from start up to (but not including) end"
+		if not (0 <= y < self.lines):
+			return
+		start = max(start, 0)
+		end = self.columns if end is None else min(end, self.columns)
+		if start < end:
+			if self.full:
+				row = self.back[y]
+			else:
+				row, columns = self._row(y)
+				columns.update(range(start, end))
+			row[start:end] = [BLANK] * (end - start)
+
+	def addstr(self, y, x, string, attr=0):
+		"Draws a string into the back buffer. Anything outside of the screen is clipped."
+		if not (0 <= y < self.lines):
+			return
+		start = max(x, 0)
+		end = min(x + len(string), self.columns)
+		if start < end:
+			if self.full:
+				row = self.back[y]
+			else:
+				row, columns = self._row(y)
+				columns.update(range(start, end))
+			row[start:end] = [(c, attr) for c in string[start - x:end - x]]
+
+	def addch(self, y, x, char, attr=0):
+		"Draws a single character into the back buffer, if it's on the screen"
+		if 0 <= y < self.lines and 0 <= x < self.columns:
+			if self.full:
+				self.back[y][x] = (char, attr)
+			else:
+				row, columns = self._row(y)
+				row[x] = (char, attr)
+				columns.add(x)
+
+	def _write(self, y, x, chars, attr):
+		try:
+			self.screen.addstr(y, x, "".join(chars), attr)
+		except curses.error: #Writing the bottom right cell of a curses window raises an error after the write
+			pass
+
+	def present(self, cursor=None):
+		"Writes the cells that changed since the last frame to the screen"
+		screen = self.screen
+		back = self.back
+		front = self.front
+		if front is None:
+			screen.erase()
+			front = [[BLANK] * self.columns for _ in range(self.lines)]
+			rows = ((y, range(self.columns)) for y in range(self.lines))
+		else: #Only the rows and columns that were drawn to can have changed
+			rows = ((y, sorted(columns)) for y, columns in self.touched.items())
+		written = 0
+		for y, columns in rows:
+			row = back[y]
+			old = front[y]
+			if row == old:
+				continue
+			changed = [x for x in columns if row[x] != old[x]]
+			written += len(changed)
+			#Write runs of consecutive cells that share the same attribute
+			run = changed[0]
+			last = run - 1
+			attr = row[run][1]
+			chars = []
+			for x in changed:
+				char, a = row[x]
+				if x != last + 1 or a != attr:
+					self._write(y, run, chars, attr)
+					run = x
+					attr = a
+					chars = []
+				chars.append(char)
+				last = x
+			self._write(y, run, chars, attr)
+		self.front = back
+		self.back = []
+		self.touched = {}
+		self.frames += 1
+		self.cells_written += written
+		if cursor is not None:
+			try:
+				screen.move(*cursor)
+			except curses.error:
+				pass
+		screen.noutrefresh()
+		if self.update:
+			self.update()
+		return written
@@ -0,0 +1,228 @@
+#Input recording and replay
+#A recording holds the game's seed (and, for a game continued from a save, the state it started from), followed by
+#every key the player pressed along with the tick it was pressed on. Since all of the game's randomness comes from its
+#seed, feeding the same keys back into a game with the same seed plays out exactly the same way.
+#
+#Replays run headless and as fast as possible, which makes recordings of real games useful as benchmark workloads, and
+#as a check that an optimization doesn't change how the game plays out (see state_digest).
+#
+#File format: a header (magic, version, seed, board size, length of the start state), the start state (if any), then one entry
+#per key. Each entry starts with a varint of (ticks since the previous entry << 1 | is_string), followed by a varint
+#of the key code, or for a string typed at a prompt, a varint of its length and its bytes.
+import struct, hashlib, os, tempfile, time
+from headless import HeadlessScreen, ScriptExhausted
+
+MAGIC = b"VDRI"
+VERSION = 1
+#Seeds are signed, since the game accepts negative ones
+HEADER = struct.Struct("<4sHqHHI") #Magic, version, seed, board columns and rows, length of start state
+SEED_RANGE = (-2**63, 2**63 - 1) #Seeds that fit in the header
+
+class ReplayError(Exception):
+	pass
+
+def write_varint(out, n):
+	while n >= 0x80:
+		out.append(n & 0x7F | 0x80)
+		n >>= 7
+	out.append(n)
+
+def read_varint(data, pos):
+	n = shift = 0
+	while True:
+		b = data[pos]
+		pos += 1
+		n |= (b & 0x7F) << shift
+		if b < 0x80:
+			return n, pos
+		shift += 7
+
+class Recording:
+
+	def __init__(self, seed, board_size, start_state=b"", entries=None):
+		self.seed = seed
+		self.board_size = board_size
+		self.start_state = start_state #Save data the game started from, or empty for a new game
+		self.entries = entries if entries is not None else [] #(tick, key), where key is an int, or bytes for getstr
+
+	@classmethod
+	def load(cls, path):
+		with open(path, "rb") as f:
+			data = f.read()
+		if len(data) < HEADER.size or data[:4] != MAGIC:
+			raise ReplayError("Not a recording")
+		_, version, seed, cols, rows, state_len = HEADER.unpack_from(data)
+		if version > VERSION:
+			raise ReplayError(f"Recording is from a newer version of the game (format {version})")
+		board_size = (cols, rows)
+		pos = HEADER.size
+		start_state = data[pos:pos + state_len]
+		pos += state_len
+		entries = []
+		tick = 0
+		try:
+			while pos < len(data):
+				head, pos = read_varint(data, pos)
+				tick += head >> 1
+				if head & 1:
+					length, pos = read_varint(data, pos)
+					key = data[pos:pos + length]
+					pos += length
+				else:
+					key, pos = read_varint(data, pos)
+				entries.append((tick, key))
+		except IndexError:
+			pass #The game stopped partway through writing the last entry
+		return cls(seed, board_size, start_state, entries)
+
+class Recorder:
+	"""
+	Wraps a screen and writes every key read from it to a recording.
+	Entries are written as they happen, so a recording survives the game crashing.
+	"""
+
+	def __init__(self, g, screen, path, start_state=b""):
+		self.g = g
+		self.screen = screen
+		self.file = open(path, "wb")
+		board = g.board
+		self.file.write(HEADER.pack(MAGIC, VERSION, g.rng.seed, board.cols, board.rows, len(start_state)) + start_state)
+		self.file.flush()
+		self.last_tick = 0
+
+	def __getattr__(self, name):
+		return getattr(self.screen, name)
+
+	def _write(self, key):
+		tick = self.g.player.ticks
+		out = bytearray()
+		if isinstance(key, bytes):
+			write_varint(out, (tick - self.last_tick) << 1 | 1)
+			write_varint(out, len(key))
+			out += key
+		else:
+			write_varint(out, (tick - self.last_tick) << 1)
+			write_varint(out, key)
+		self.last_tick = tick
+		self.file.write(out)
+		self.file.flush()
+
+	def getch(self):
+		key = self.screen.getch()
+		if key != -1: #Nothing was pressed while polling
+			self._write(key)
+		return key
+
+	def getstr(self):
+		string = self.screen.getstr()
+		self._write(string)
+		return string
+
+	def close(self):
+		self.file.close()
+
+def start_recording(g, path, loaded=False):
+	"""
+	Starts recording the keys read by a game to path, returning the Recorder.
+	A new game can be reproduced from its seed alone, but a loaded one (loaded=True) needs the state it started from.
+	The game is reloaded from that state, so that the game being played and the replay start out exactly the same.
+	"""
+	from savefile import encode_game, decode_game
+	start_state = b""
+	if loaded:
+		start_state = encode_game(g)
+		decode_game(g, start_state)
+	g.screen = g.renderer.screen = recorder = Recorder(g, g.screen, path, start_state)
+	return recorder
+
+class ReplayScreen(HeadlessScreen):
+	"Hands out the keys of a recording. While polling, a key is only handed out once the game reaches the tick it was pressed on."
+
+	def __init__(self, recording):
+		super().__init__()
+		self.g = None #The game being replayed; set once it's created
+		self.entries = recording.entries
+		self.pos = 0
+		self.divergences = 0 #Keys read on a different tick than when they were recorded
+
+	def next_entry(self):
+		if self.pos >= len(self.entries):
+			raise ScriptExhausted("End of recording")
+		tick, key = self.entries[self.pos]
+		ticks = self.g.player.ticks
+		if self.no_delay and tick > ticks:
+			return None
+		if tick != ticks:
+			self.divergences += 1
+		self.pos += 1
+		return key
+
+	def getch(self):
+		key = self.next_entry()
+		if key is None:
+			return -1
+		if isinstance(key, bytes): #The game asked for a key where a string was typed before
+			self.divergences += 1
+			return 10
+		return key
+
+	def getstr(self):
+		key = self.next_entry()
+		if not isinstance(key, bytes):
+			self.divergences += 1
+			return b""
+		return key
+
+def state_digest(g):
+	"Returns a hash of the state of a game, for checking that two runs played out the same way"
+	p = g.player
+	return hashlib.sha256(repr((
+		p.ticks, p.x, p.y, p.HP, p.exp, g.level, p.dead,
+		[(type(m).__name__, m.x, m.y, m.HP) for m in g.monsters],
+		list(g.msg_list),
+		g.rng.__getstate__()
+	)).encode()).hexdigest()
+
+def start_game(g, start_state=b""):
+	"Sets up a game the same way as roguelike.py does before the first key is read, starting from start_state if given"
+	from savefile import decode_game
+	g.print_msg("Welcome to VeraDugeon Rogue v0.5")
+	g.print_msg("Press \"?\" if you want to view the controls.")
+	if start_state:
+		decode_game(g, start_state)
+	else:
+		g.generate_level()
+	g.draw_board()
+	g.refresh_cache()
+
+def replay(path):
+	"""
+	Plays a recording back in a headless game, as fast as possible.
+	Returns a dict with the final game, how many keys and turns were played, how long it took and the state digest.
+	"""
+	from gameobj import Game
+	from roguelike import play
+	recording = Recording.load(path)
+	save_dir = tempfile.mkdtemp()
+	save_path = os.path.join(save_dir, "save.dat")
+	screen = ReplayScreen(recording)
+	g = Game(headless=True, save_path=save_path, seed=recording.seed, screen=screen, board_size=recording.board_size)
+	screen.g = g
+	start_game(g, recording.start_state)
+	start = time.perf_counter()
+	try:
+		play(g)
+	except ScriptExhausted:
+		pass
+	elapsed = time.perf_counter() - start
+	g.saver.flush()
+	g.delete_saved_game()
+	os.rmdir(save_dir)
+	return {
+		"game": g,
+		"keys": screen.pos,
+		"turns": g.player.ticks,
+		"seconds": elapsed,
+		"divergences": screen.divergences,
+		"digest": state_digest(g)
+	}
@@ -0,0 +1,150 @@
+#Random number streams
+#All of the game's randomness comes from a handful of independent, seeded streams, so that a game can be reproduced
+#exactly from its seed (and the player's input). Each stream covers one part of the game:
+# - "gen": level generation
+# - "combat": attacks and damage, and anything the player does
+# - "ai": monster turns
+#Because the streams are separate, e.g. a monster making a different decision doesn't change the layout of later levels.
+#
+#Game code uses the random module through the proxy defined here (from rng import random). Code switches to a stream
+#with "with use(name):", or by decorating a function with @uses_stream(name).
+#
+#Each stream is a plain random.Random. Switching streams rebinds the proxy's methods to the new stream's bound methods,
+#so a call like random.randint() costs the same as it does on the random module itself.
+#
+#A stream's state is about 2.5 KB, but between two saves a stream usually only moves on by a few hundred numbers, so
+#save journals record how far each stream moved on instead (see words_between).
+import random as _random
+import hashlib
+from array import array
+from functools import wraps
+
+STREAMS = ("gen", "combat", "ai")
+DEFAULT_STREAM = "combat"
+STATE_WORDS = 624 #The size of the Mersenne Twister's state, in 32-bit words
+MAX_ADVANCE = 1 << 16 #How far words_between looks ahead before giving up
+#The methods that are bound directly onto the proxy; anything else is looked up on the current stream
+PROXIED = ("random", "randint", "randrange", "choice", "choices", "shuffle", "sample", "uniform", "getrandbits")
+
+def stream_seed(key):
+	#Seeding from a hash of the key, rather than the key itself, keeps the streams the same in every process whatever
+	#PYTHONHASHSEED is, and makes streams with similar keys unrelated
+	return int.from_bytes(hashlib.sha256(str(key).encode()).digest(), "little")
+
+class Stream(_random.Random):
+	"A random.Random for one stream, which also keeps the bound methods that the proxy hands out"
+
+	def __init__(self, key):
+		super().__init__(stream_seed(key))
+		self.methods = {name: getattr(self, name) for name in PROXIED}
+
+	def pack_state(self):
+		"Returns the state of the Mersenne Twister as bytes, which is much smaller than its tuple form"
+		return array("I", self.getstate()[1]).tobytes()
+
+	def unpack_state(self, data):
+		self.setstate((self.VERSION, tuple(array("I", data)), None))
+
+def _state_index(packed):
+	"The position of a packed state in its block of words; each 32-bit word that is drawn moves it on by one"
+	return int.from_bytes(packed[-4:], "little")
+
+def _generator(packed):
+	s = _random.Random()
+	s.setstate((s.VERSION, tuple(array("I", packed)), None))
+	return s
+
+def words_between(old, new, limit=MAX_ADVANCE):
+	"""
+	Returns how many 32-bit words have to be drawn from a stream with the packed state old for it to reach the packed
+	state new, or None if that's more than limit (or new doesn't follow from old at all).
+	"""
+	s = _generator(old)
+	#The position in the block only gives the distance up to a multiple of the block size, so each candidate is checked
+	#by drawing that far ahead
+	step = (_state_index(new) - _state_index(old)) % STATE_WORDS
+	words = 0
+	while words + step <= limit:
+		if step:
+			s.getrandbits(32 * step)
+		words += step
+		if array("I", s.getstate()[1]).tobytes() == new:
+			return words
+		step = STATE_WORDS
+	return None
+
+def advance_state(packed, words):
+	"Returns the packed state of a stream after drawing the given number of 32-bit words from the packed state"
+	s = _generator(packed)
+	if words:
+		s.getrandbits(32 * words)
+	return array("I", s.getstate()[1]).tobytes()
+
+class RandomStreams:
+	"The set of random streams for a game, all derived from one seed"
+
+	def __init__(self, seed=None):
+		if seed is None:
+			seed = _random.getrandbits(32)
+		self.seed = seed
+		self.streams = {name: Stream(f"{seed}:{name}") for name in STREAMS}
+
+	def __getstate__(self):
+		#One field per stream, so that a save journal only has to record the streams that were drawn from
+		state = {"seed": self.seed}
+		for name, s in self.streams.items():
+			state[name] = s.pack_state()
+		return state
+
+	def __setstate__(self, state):
+		self.seed = state["seed"]
+		self.streams = {name: Stream(f"{self.seed}:{name}") for name in STREAMS}
+		for name in STREAMS:
+			if name in state:
+				self.streams[name].unpack_state(state[name])
+
+	def activate(self):
+		"Makes these the streams that the random proxy uses"
+		global _active
+		_active = self
+		_switch(self.streams[DEFAULT_STREAM])
+
+class _RandomProxy:
+	"Stands in for the random module, with the methods of the stream currently in use bound onto it"
+
+	def __getattr__(self, name):
+		return getattr(_current, name)
+
+random = _RandomProxy()
+
+def _switch(stream):
+	global _current
+	_current = stream
+	random.__dict__ = stream.methods #Rebinds all of the proxied methods at once
+
+#Used until a game activates its own streams
+RandomStreams().activate()
+
+class use:
+	"Context manager that switches to the named stream of the active streams"
+	__slots__ = ("name", "prev")
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.prev = _current
+		_switch(_active.streams[self.name])
+
+	def __exit__(self, *exc):
+		_switch(self.prev)
+
+def uses_stream(name):
+	"Decorator for functions whose randomness should come from the named stream"
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with use(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
@@ -0,0 +1,191 @@
+#Room graph
+#A map of how the level is laid out, built from the rooms that Board.generate placed and the terrain it carved.
+#Every floor cell belongs to a region: either a room, or a corridor segment, which is a connected stretch of floor
+#outside of any room. Corridors that cross each other join into one segment, and a corridor that passes through a
+#room is split into a segment on either side of it. Regions are linked wherever a corridor segment touches a room,
+#and the corridor cells next to the room are its doors.
+#
+#Since rooms are never placed next to each other, every link joins a room and a corridor segment, and two cells are
+#connected by floor exactly when their regions are connected in the graph.
+#
+#Regions are numbered with the rooms first, in the order they were placed, followed by the corridor segments.
+#
+#Long paths are planned over the graph first (see route), which only has to look at the rooms and corridors along the
+#way, rather than at every cell in between like a search over the grid does.
+import heapq
+from array import array
+from rng import random
+
+class RoomGraph:
+
+	def __init__(self, board, rooms):
+		cols = board.cols
+		rows = board.rows
+		size = cols * rows
+		walkable = board.walkable
+		self.cols = cols
+		self.revision = board.revision #The revision of the terrain it was built from
+		self.rooms = list(rooms) #(x, y, width, height) of each room
+		self.corridors = [] #Cells (as indices y*cols + x) of each corridor segment
+		self.links = [{} for _ in self.rooms] #For each region, the regions linked to it -> the doors between them
+		#The region of every cell, plus one, so that 0 is left for cells that aren't part of any region (walls)
+		region = self.region = array("H", bytes(2 * size))
+		for i, (x, y, w, h) in enumerate(self.rooms):
+			span = array("H", [i + 1]) * w
+			for row in range(y, y + h):
+				base = row * cols + x
+				region[base:base + w] = span
+		num_rooms = len(self.rooms)
+		index = walkable.find(1)
+		while index != -1:
+			if not region[index]:
+				self._flood_corridor(index, walkable, num_rooms)
+			index = walkable.find(1, index + 1)
+
+	def _flood_corridor(self, start, walkable, num_rooms):
+		cols = self.cols
+		size = len(self.region)
+		region = self.region
+		corridor = len(self.rooms) + len(self.corridors)
+		if corridor >= 0xFFFF:
+			raise ValueError("Too many regions for a room graph")
+		links = {}
+		self.links.append(links)
+		cells = [start]
+		region[start] = corridor + 1
+		for curr in cells: #Grows while it's being iterated over, as a breadth-first search
+			x = curr % cols
+			for n in (
+				curr + cols if curr + cols < size else -1,
+				curr - cols,
+				curr + 1 if x + 1 < cols else -1,
+				curr - 1 if x > 0 else -1
+			):
+				if n < 0 or not walkable[n]:
+					continue
+				r = region[n]
+				if not r:
+					region[n] = corridor + 1
+					cells.append(n)
+				elif r <= num_rooms: #A room; curr is one of its doors
+					doors = links.get(r - 1)
+					if doors is None:
+						doors = links[r - 1] = []
+						self.links[r - 1][corridor] = doors
+					if not doors or doors[-1] != curr:
+						doors.append(curr)
+		self.corridors.append(cells)
+
+	@property
+	def num_regions(self):
+		return len(self.rooms) + len(self.corridors)
+
+	def region_at(self, x, y):
+		"Returns the region a cell belongs to, or None if it isn't floor"
+		r = self.region[x + y * self.cols]
+		return r - 1 if r else None
+
+	def is_room(self, region):
+		return region < len(self.rooms)
+
+	def room_at(self, x, y):
+		"Returns the index of the room a cell is in, or None if it isn't in a room"
+		r = self.region[x + y * self.cols]
+		return r - 1 if 0 < r <= len(self.rooms) else None
+
+	def neighbors(self, region):
+		"Returns the regions linked to a region"
+		return list(self.links[region])
+
+	def doors(self, region, other):
+		"Returns the doors (as (x, y)) between two linked regions"
+		cols = self.cols
+		return [(i % cols, i // cols) for i in self.links[region].get(other, ())]
+
+	def cells(self, region):
+		"Returns the cells of a region, as (x, y)"
+		if self.is_room(region):
+			x, y, w, h = self.rooms[region]
+			return [(x + dx, y + dy) for dy in range(h) for dx in range(w)]
+		cols = self.cols
+		return [(i % cols, i // cols) for i in self.corridors[region - len(self.rooms)]]
+
+	def random_cell(self, region):
+		"Returns a random cell of a region, as (x, y)"
+		if self.is_room(region):
+			x, y, w, h = self.rooms[region]
+			return (x + random.randrange(w), y + random.randrange(h))
+		i = random.choice(self.corridors[region - len(self.rooms)])
+		return (i % self.cols, i // self.cols)
+
+	def connected(self, pos1, pos2):
+		"Returns whether there's a path over floor between two cells, going by the graph"
+		start = self.region_at(*pos1)
+		end = self.region_at(*pos2)
+		if start is None or end is None:
+			return False
+		seen = {start}
+		frontier = [start]
+		for r in frontier:
+			if r == end:
+				return True
+			for n in self.links[r]:
+				if n not in seen:
+					seen.add(n)
+					frontier.append(n)
+		return False
+
+	def route(self, start, end):
+		"""
+		Plans a route from start to end over the graph, ignoring monsters. Returns the doors to go through, as (x, y),
+		followed by end; or None if end can't be reached from start. If either of them isn't on the floor, which the
+		graph doesn't cover, the route is just end.
+		Each region is entered through one of its doors, and distances within a region are estimated as the Manhattan
+		distance between where it's entered and where it's left, so the route is close to, but not always, the shortest.
+		"""
+		start_region = self.region_at(*start)
+		end_region = self.region_at(*end)
+		if start_region is None or end_region is None:
+			return [end]
+		cols = self.cols
+		ex, ey = end
+		entry = {start_region: start} #Where each region is entered
+		gscore = {start_region: 0}
+		parent = {start_region: None}
+		closed = set()
+		open_heap = [(abs(start[0] - ex) + abs(start[1] - ey), 0, start_region)]
+		while open_heap:
+			_, g, r = heapq.heappop(open_heap)
+			if r == end_region:
+				break
+			if r in closed:
+				continue
+			closed.add(r)
+			px, py = entry[r]
+			for n, doors in self.links[r].items():
+				if n in closed:
+					continue
+				#Go through whichever door looks best for getting to the end
+				best = None
+				for d in doors:
+					dx, dy = d % cols, d // cols
+					to_door = abs(dx - px) + abs(dy - py)
+					f = to_door + abs(dx - ex) + abs(dy - ey)
+					if best is None or f < best[0]:
+						best = (f, to_door, (dx, dy))
+				f, to_door, door = best
+				t = g + to_door
+				if t < gscore.get(n, t + 1):
+					gscore[n] = t
+					entry[n] = door
+					parent[n] = r
+					heapq.heappush(open_heap, (g + f, t, n))
+		else:
+			return None
+		waypoints = [end]
+		r = end_region
+		while parent[r] is not None:
+			waypoints.append(entry[r])
+			r = parent[r]
+		waypoints.reverse()
+		return waypoints
@@ -0,0 +1,755 @@
+#Save file format
+#Instead of pickling the whole Game object graph, the game is broken down into plain data:
+# - The board is stored as a palette of terrain names, plus grids of palette indices and tile flags, one byte per
+#   cell. The grids of big boards are compressed on their own, since they're mostly long runs of the same wall or
+#   floor. Nothing else is, since the rest (the random streams' states most of all) doesn't shrink enough to be worth
+#   the time it takes.
+# - Monsters, items and any other objects (the player, effects, attacks, dice...) are stored once each in tables, as
+#   their type name and their fields. Fields that refer to another object store its table and index instead.
+#   Nothing refers to a class directly, so renaming or moving code around doesn't break old saves, and a field added
+#   to a class only needs a migration to backfill it.
+#
+#The file starts with a header of a magic number, the format version and a checksum, followed by the pickled data.
+#When loading a save written by an older version, the data is upgraded one version at a time by MIGRATIONS.
+#
+#Most saves only differ from the previous one in a few places, so rather than writing the whole game every time, each
+#save after the first appends a delta record to a journal file next to the save, holding only the parts that changed.
+#Grids only record the runs of cells that changed. Loading replays the journal on top of the full save. Once the journal gets large compared to the full save, it's
+#compacted by writing a new full save and starting a new journal.
+import struct, zlib, pickle, io, threading
+from collections import deque, defaultdict
+from itertools import chain, compress
+from rng import STREAMS, words_between, advance_state
+
+MAGIC = b"VDRS"
+VERSION = 1
+HEADER = struct.Struct("<4sHI") #Magic, version, CRC32 of the data
+JOURNAL_MAGIC = b"VDRJ"
+JOURNAL_HEADER = struct.Struct("<4sI") #Magic, CRC32 of the data in the full save that the journal applies to
+RECORD_HEADER = struct.Struct("<II") #Length and CRC32 of a delta record
+COMPACT_RATIO = 2 #The journal is compacted once it's this many times larger than the full save
+COMPACT_RECORDS = 200 #...or once it has this many records
+
+#Migrations from each version to the next: MIGRATIONS[v] takes the data of a version v save and returns it upgraded to version v+1
+MIGRATIONS = {}
+
+#Game attributes that are rebuilt rather than saved
+GAME_SKIP = {"board", "scheduler", "effect_types", "mon_types", "last_save", "approach", "approach_key"}
+#Object fields that are worked out again after loading
+FIELD_SKIP = {"fov"}
+GRIDS = ("terrain", "flags") #The parts of the board data that have one byte per cell
+#Boards with at least this many cells have their grids compressed in full saves. Setting zlib up takes longer than
+#writing out a smaller grid as it is.
+COMPRESS_GRIDS = 4096
+
+PLAIN = {int, str, bool, float, type(None)}
+
+#Tile flags
+REVEALED = 1
+WALKED = 2
+VISIBLE = 4 #In the player's field of view, which is saved so that it doesn't have to be worked out again on loading
+#Translation tables between the flags and the board's grids
+REVEALED_TO_FLAGS = bytes([0, REVEALED]) + bytes(254)
+FLAGS_TO_REVEALED = bytes(bool(f & REVEALED) for f in range(256))
+FLAGS_TO_WALKED = bytes(bool(f & WALKED) for f in range(256))
+FLAGS_TO_VISIBLE = bytes(bool(f & VISIBLE) for f in range(256))
+
+#Tagged values. Every tag starts with "\0", which no string used by the game does.
+REF = "\0r" #("\0r", table, index)
+GAME = "\0g" #("\0g",)
+BOARD = "\0b" #("\0b",)
+TYPE = "\0t" #("\0t", type name)
+DEQUE = "\0q" #("\0q", items, maxlen)
+DEFAULTDICT = "\0d" #("\0d", factory name, items)
+TUPLE = "\0u" #A tuple that happens to start with a tag: ("\0u", *items)
+#Only in journal records: the state of a random stream, as the number of 32-bit words it moved on since the last save
+ADVANCED = "\0a" #("\0a", words)
+
+#The fields of saved types that hold the packed state of a random stream
+STREAM_FIELDS = {"RandomStreams": set(STREAMS)}
+
+FACTORIES = {"int": int, "float": float, "list": list, "set": set, "dict": dict}
+
+class SaveFormatError(Exception):
+	pass
+
+_types = None
+
+def saved_types():
+	"Returns all the classes whose instances can appear in a save, by name"
+	global _types
+	if _types is None:
+		import utils, entity, player, monster, items, effect, rng
+		_types = {}
+		for mod in (utils, entity, player, monster, items, effect, rng):
+			for value in vars(mod).values():
+				if isinstance(value, type) and value.__module__ == mod.__name__:
+					name = value.__name__
+					assert _types.get(name, value) is value, f"Two saved types are named {name}"
+					_types[name] = value
+	return _types
+
+def _object_state(obj):
+	getstate = getattr(type(obj), "__getstate__", None)
+	if getstate is not None and getstate is not getattr(object, "__getstate__", None):
+		return getstate(obj)
+	return obj.__dict__
+
+def _fields(obj):
+	"Returns a new dict of the fields of an object that are saved"
+	fields = _object_state(obj)
+	if fields is obj.__dict__: #A __getstate__ already returns a copy
+		fields = fields.copy()
+	for k in FIELD_SKIP:
+		fields.pop(k, None)
+	return fields
+
+def _plain(values):
+	"""
+	Whether the values in a container are all plain, or all tuples of plain values (e.g. positions, messages), so that
+	a copy of the container doesn't need anything else encoding or copying. Such containers (paths, sets of cells, the
+	message log) can be long, so this mostly avoids looping over them in Python.
+	"""
+	types = set(map(type, values))
+	if types <= PLAIN:
+		return True
+	if len(types) == 1 and tuple in types:
+		types = set(map(type, chain.from_iterable(values)))
+		if not types <= PLAIN:
+			return False
+		#A tuple starting with a string that looks like a tag has to be tagged itself
+		return str not in types or "\0" not in {t[0][:1] for t in values if t and type(t[0]) is str}
+	return False
+
+def _board_fields(g):
+	"The parts of the board that are saved, along with the player's field of view, which is saved with the board"
+	board = g.board
+	return {
+		"fov": g.player.fov,
+		"cols": board.cols,
+		"rows": board.rows,
+		"terrain": board.terrain,
+		"revealed": board.revealed,
+		"walked": board.walked,
+		"items": board.items,
+		"rooms": board.rooms
+	}
+
+class _Copier:
+	"""
+	Copies the state of the game, for an _Encoder to encode later on another thread.
+	Objects themselves aren't copied; fields that refer to another object keep referring to it, and that object's
+	fields are copied separately. When an object's fields are the same as they were at the last copy, the last copy is
+	reused, which saves copying it and lets the encoder reuse its encoding. Most objects don't change between saves
+	(e.g. monsters far from the player), so most of a copy is usually reused.
+	Whether something changed is checked by comparing it with its last copy, so a value that was replaced by an equal
+	one of another type (e.g. 1 by True) keeps its old type until something else about it changes.
+	"""
+
+	def __init__(self, g):
+		self.g = g
+		self.board = g.board
+		self.known = {} #id(obj) -> (obj, fields, objects the fields refer to, number of attributes) as of the last copy
+		self.found = [] #Objects referred to by what's being copied
+		self.parts = {} #"game"/"board" -> (fields, objects each field refers to) as of the last copy
+
+	def value(self, v):
+		t = type(v)
+		if t in PLAIN or t is bytes:
+			return v
+		if t is tuple:
+			if PLAIN.issuperset(map(type, v)):
+				return v
+			return tuple(map(self.value, v))
+		if t is list:
+			return v[:] if _plain(v) else list(map(self.value, v))
+		if t is set or t is frozenset:
+			return t(v) if _plain(v) else t(map(self.value, v))
+		if t is dict:
+			if _plain(v) and _plain(v.values()):
+				return v.copy()
+			return {self.value(k): self.value(x) for k, x in v.items()}
+		if t is deque:
+			return deque(v if _plain(v) else map(self.value, v), v.maxlen)
+		if t is defaultdict:
+			return defaultdict(v.default_factory, {self.value(k): self.value(x) for k, x in v.items()})
+		if t is bytearray:
+			return bytearray(v)
+		if v is self.g or v is self.board or isinstance(v, type):
+			return v
+		self.found.append(v)
+		return v
+
+	def part(self, name, state, pending):
+		"Copies the fields of the game or the board, reusing the copies of the fields that are the same as last time"
+		last, last_refers = self.parts.get(name, ({}, {}))
+		fields = {}
+		refers = {}
+		for k, v in state.items():
+			if type(v) in PLAIN:
+				fields[k] = v
+				continue
+			if k in last and last[k] == v:
+				fields[k] = last[k]
+				found = last_refers[k]
+			else:
+				self.found = found = []
+				fields[k] = self.value(v)
+			refers[k] = found
+			pending.extend(found)
+		self.parts[name] = (fields, refers)
+		return fields
+
+	def copy(self):
+		"Returns a copy of the game's state, to pass to _Encoder.contents"
+		self.found = pending = []
+		state = self.g.__getstate__()
+		game = self.part("game", {k: v for k, v in state.items() if k not in GAME_SKIP}, pending)
+		board = self.part("board", _board_fields(self.g), pending)
+		known = self.known
+		objects = {}
+		while pending:
+			obj = pending.pop()
+			key = id(obj)
+			if key in objects:
+				continue
+			last = known.get(key)
+			if last is not None and last[3] == len(obj.__dict__) and last[1].items() <= obj.__dict__.items():
+				#Unchanged since the last copy, which is found out without copying anything
+				objects[key] = last
+				pending.extend(last[2])
+				continue
+			fields = _fields(obj)
+			self.found = found = []
+			for k, v in fields.items():
+				if type(v) not in PLAIN: #Most fields are, and fields is already a copy
+					fields[k] = self.value(v)
+			#Objects whose saved fields are just some of their attributes can be checked against their attributes directly
+			#next time. For any others, the check always fails, so they're copied every time.
+			size = len(obj.__dict__) if fields.items() <= obj.__dict__.items() else -1
+			objects[key] = (obj, fields, found, size)
+			self.found = pending
+			pending.extend(found)
+		self.known = objects #Also forgets objects that are gone from the game
+		return {"game": game, "board": board, "objects": objects}
+
+class _Encoder:
+
+	def __init__(self, g, board=None):
+		from monster import Monster
+		from items import Item
+		self.g = g
+		self.board = g.board if board is None else board
+		self.types = saved_types()
+		self.tables = {"monsters": [], "items": [], "objects": []}
+		#id(obj) -> (obj, reference). Holding on to the object ensures its id isn't reused by another one while the
+		#encoder is around, since an encoder can be kept across saves so that objects keep the same index.
+		self.refs = {}
+		self.kinds = ((Monster, "monsters"), (Item, "items"))
+		self.queue = []
+		self.seen = set()
+		self.objects = None #The copied fields of objects, when encoding a copy of the game
+		self.encoded = {} #id(obj) -> (copied fields, encoded entry), for reusing the encoding of objects that didn't change
+
+	def ref(self, obj):
+		key = id(obj)
+		known = self.refs.get(key)
+		if known is not None:
+			ref = known[1]
+			if key in self.seen:
+				return ref
+		else:
+			name = type(obj).__name__
+			if self.types.get(name) is not type(obj):
+				raise SaveFormatError(f"Can't save an object of type {type(obj).__qualname__}")
+			table = "objects"
+			for cls, kind in self.kinds:
+				if isinstance(obj, cls):
+					table = kind
+					break
+			entries = self.tables[table]
+			ref = (REF, table, len(entries))
+			self.refs[key] = (obj, ref)
+			entries.append(None)
+		self.seen.add(key)
+		self.queue.append((obj, self.tables[ref[1]], ref[2]))
+		return ref
+
+	def value(self, v):
+		t = type(v)
+		if t in PLAIN:
+			return v
+		if t is tuple:
+			if v and type(v[0]) is str and v[0][:1] == "\0":
+				return (TUPLE,) + tuple(map(self.value, v))
+			if PLAIN.issuperset(map(type, v)):
+				return v #Most tuples are just positions, which don't need any encoding
+			return tuple(map(self.value, v))
+		if t is list:
+			return v[:] if _plain(v) else list(map(self.value, v))
+		if t is set or t is frozenset:
+			return t(v) if _plain(v) else t(map(self.value, v))
+		if t is dict:
+			if _plain(v) and _plain(v.values()):
+				return v.copy()
+			return {self.value(k): self.value(x) for k, x in v.items()}
+		if t is deque:
+			return (DEQUE, list(v) if _plain(v) else list(map(self.value, v)), v.maxlen)
+		if t is defaultdict:
+			factory = v.default_factory.__name__
+			if FACTORIES.get(factory) is not v.default_factory:
+				raise SaveFormatError(f"Can't save a defaultdict of {factory}")
+			return (DEFAULTDICT, factory, {self.value(k): self.value(x) for k, x in v.items()})
+		if t is bytes:
+			return v
+		if t is bytearray:
+			return bytearray(v) #Copied, since the contents mustn't share anything the game can change
+		if v is self.g:
+			return (GAME,)
+		if v is self.board:
+			return (BOARD,)
+		if isinstance(v, type):
+			if self.types.get(v.__name__) is not v:
+				raise SaveFormatError(f"Can't save a reference to {v.__qualname__}")
+			return (TYPE, v.__name__)
+		return self.ref(v)
+
+	def flush(self):
+		"Encodes every object that has been referenced so far, along with whatever those objects refer to"
+		queue = self.queue
+		objects = self.objects
+		last_encoded = self.encoded
+		encoded = {}
+		while queue:
+			obj, entries, index = queue.pop()
+			if objects is None:
+				fields = _fields(obj)
+				for k, v in fields.items():
+					if type(v) not in PLAIN:
+						fields[k] = self.value(v)
+				entries[index] = (type(obj).__name__, fields)
+				continue
+			key = id(obj)
+			_, fields, refers, _ = objects[key]
+			last = last_encoded.get(key)
+			if last is not None and last[0] is fields: #The same copy as last time, so the same encoding
+				entry = last[1]
+				for other in refers:
+					self.ref(other)
+			else:
+				entry = (type(obj).__name__, {k: v if type(v) in PLAIN else self.value(v) for k, v in fields.items()})
+			encoded[key] = (fields, entry)
+			entries[index] = entry
+		if objects is not None:
+			self.encoded = encoded
+
+	def board_data(self, board):
+		from board import TERRAIN
+		flags = bytearray(board["revealed"].translate(REVEALED_TO_FLAGS))
+		for index in board["walked"]:
+			flags[index] |= WALKED
+		cols = board["cols"]
+		for x, y in board["fov"]:
+			flags[x + y * cols] |= VISIBLE
+		items = board["items"]
+		return {
+			"cols": board["cols"],
+			"rows": board["rows"],
+			"palette": [t.name for t in TERRAIN], #The terrain grid is saved as is, so its codes are indices into the terrain table
+			"terrain": bytes(board["terrain"]),
+			"flags": bytes(flags),
+			"items": [(index, self.value(items[index])) for index in sorted(items)],
+			"rooms": [tuple(room) for room in board["rooms"]]
+		}
+
+	def contents(self, copy=None):
+		"Encodes the game into plain data, either as it is now, or from a copy of it taken by a _Copier"
+		self.seen = set()
+		if copy is None:
+			self.objects = None
+			state = self.g.__getstate__()
+			game = {k: self.value(v) for k, v in state.items() if k not in GAME_SKIP}
+			board = self.board_data(_board_fields(self.g))
+		else:
+			self.objects = copy["objects"]
+			game = {k: self.value(v) for k, v in copy["game"].items()}
+			board = self.board_data(copy["board"])
+		self.flush()
+		contents = {"game": game, "board": board}
+		for table, entries in self.tables.items():
+			contents[table] = entries[:]
+		return contents
+
+def pack(delta):
+	"Returns the payload of a journal record"
+	return zlib.compress(pickle.dumps(delta, pickle.HIGHEST_PROTOCOL), 1)
+
+def pack_save(contents):
+	"Returns the payload of a full save"
+	board = contents["board"]
+	if board["cols"] * board["rows"] >= COMPRESS_GRIDS:
+		board = {**board, **{k: zlib.compress(board[k], 1) for k in GRIDS}, "compressed": True}
+	return pickle.dumps({**contents, "board": board}, pickle.HIGHEST_PROTOCOL)
+
+def encode_game(g):
+	"Returns the save data for a game, as bytes"
+	payload = pack_save(_Encoder(g).contents())
+	return HEADER.pack(MAGIC, VERSION, zlib.crc32(payload)) + payload
+
+def _deque_delta(old, new):
+	"If a deque has only had items added to its end (and old ones pushed out of the front), returns how many were pushed out and the new ones"
+	_, old_items, maxlen = old
+	_, new_items, new_maxlen = new
+	if maxlen != new_maxlen:
+		return None
+	for dropped in range(len(old_items) + 1):
+		kept = len(old_items) - dropped
+		if old_items[dropped:] == new_items[:kept]:
+			return (dropped, new_items[kept:])
+	return None
+
+def _grid_delta(old, new, cols):
+	"Returns the runs of cells that changed between two grids of the same size, as (start, new cells) pairs"
+	runs = []
+	#Comparing a row at a time skips over the rows that didn't change without looking at each cell
+	for start in range(0, len(new), cols):
+		end = start + cols
+		if old[start:end] == new[start:end]:
+			continue
+		while old[start] == new[start]:
+			start += 1
+		while old[end - 1] == new[end - 1]:
+			end -= 1
+		runs.append((start, new[start:end]))
+	return runs
+
+def diff_contents(old, new):
+	"Returns a delta record holding what changed between two sets of save contents, or None if nothing changed"
+	delta = {}
+	game = {}
+	extend = {}
+	old_game = old["game"]
+	for k, v in new["game"].items():
+		prev = old_game.get(k)
+		if prev == v:
+			continue
+		if type(v) is tuple and v and v[0] == DEQUE and type(prev) is tuple and prev and prev[0] == DEQUE:
+			#Message logs only ever have new messages added, so there's no need to write out the whole thing again
+			change = _deque_delta(prev, v)
+			if change is not None:
+				extend[k] = change
+				continue
+		game[k] = v
+	if game:
+		delta["game"] = game
+	if extend:
+		delta["extend"] = extend
+	board = {k: v for k, v in new["board"].items() if old["board"].get(k) != v}
+	if (old["board"]["cols"], old["board"]["rows"]) == (new["board"]["cols"], new["board"]["rows"]):
+		grids = {k: _grid_delta(old["board"][k], board.pop(k), new["board"]["cols"]) for k in GRIDS if k in board}
+		if grids:
+			delta["grids"] = grids
+	if board:
+		delta["board"] = board
+	for table in ("monsters", "items", "objects"):
+		old_entries = old[table]
+		changed = []
+		for index, entry in enumerate(new[table]):
+			prev = old_entries[index] if index < len(old_entries) else None
+			if prev == entry:
+				continue
+			if prev is None or prev[0] != entry[0]:
+				changed.append((index, entry[0], entry[1], ()))
+				continue
+			#Only the fields that changed, e.g. a monster's position and HP
+			prev_fields = prev[1]
+			fields = {k: v for k, v in entry[1].items() if k not in prev_fields or prev_fields[k] != v}
+			for k in STREAM_FIELDS.get(entry[0], ()) & fields.keys():
+				if k in prev_fields:
+					words = words_between(prev_fields[k], fields[k])
+					if words is not None:
+						fields[k] = (ADVANCED, words)
+			removed = tuple(k for k in prev_fields if k not in entry[1])
+			changed.append((index, None, fields, removed))
+		if changed:
+			delta[table] = changed
+	return delta or None
+
+def apply_delta(contents, delta):
+	"Applies a delta record (from diff_contents) to a set of save contents"
+	game = contents["game"]
+	game.update(delta.get("game", {}))
+	for k, (dropped, added) in delta.get("extend", {}).items():
+		tag, items, maxlen = game[k]
+		game[k] = (tag, items[dropped:] + added, maxlen)
+	board = contents["board"]
+	board.update(delta.get("board", {}))
+	for k, runs in delta.get("grids", {}).items():
+		grid = bytearray(board[k])
+		for start, cells in runs:
+			grid[start:start + len(cells)] = cells
+		board[k] = bytes(grid)
+	for table in ("monsters", "items", "objects"):
+		entries = contents[table]
+		for index, name, fields, removed in delta.get(table, ()):
+			if index >= len(entries):
+				entries.extend([None] * (index + 1 - len(entries)))
+			if name is None:
+				#Only some of the fields changed
+				name, old_fields = entries[index]
+				for k in STREAM_FIELDS.get(name, ()) & fields.keys():
+					if type(fields[k]) is tuple and fields[k][0] == ADVANCED:
+						fields[k] = advance_state(old_fields[k], fields[k][1])
+				fields = {**old_fields, **fields}
+				for k in removed:
+					del fields[k]
+			entries[index] = (name, fields)
+
+def journal_path(path):
+	return path + ".journal"
+
+class SaveJournal:
+	"""
+	Keeps track of what was last saved, so that each save only needs to write what changed since then.
+	Saving is split in two, so that most of the work can be done off the game thread: snapshot() takes a copy of the
+	game's state, and writes() encodes a snapshot into the file writes to make, as (path, data, append) tuples, for a
+	SaveWriter to carry out. Snapshots must be passed to writes() in the order they were taken.
+	Only copying is done on the game thread; encoding, diffing and compressing are all left to writes().
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		"Forgets what was saved before, so that the next save is a full one"
+		with self.lock:
+			self.copier = None
+			self.encoder = None
+			self.last = None #Contents as of the last save that was encoded
+			self.snapshot_crc = None
+			self.snapshot_size = 0
+			self.journal_size = 0
+			self.records = 0
+
+	def snapshot(self, g):
+		"Returns a snapshot of the game to pass to writes(). The game mustn't change while this runs."
+		copier = self.copier
+		if copier is None or copier.g is not g or copier.board is not g.board:
+			self.reset()
+		with self.lock:
+			compact = self.copier is None or self.journal_size >= COMPACT_RATIO * self.snapshot_size or self.records >= COMPACT_RECORDS
+			if compact:
+				self.journal_size = 0
+				self.records = 0
+		if compact:
+			#Starting over drops objects that are gone from the game
+			self.copier = _Copier(g)
+		#The copy shares no containers with the game, and the objects in it are only used for their identity and type,
+		#so it can be encoded on another thread while the game carries on
+		return (self.copier.copy(), compact, g, g.board)
+
+	def writes(self, snapshot, path):
+		"Encodes a snapshot into the writes to make, which are either a full save or a journal record"
+		copy, compact, g, board = snapshot
+		with self.lock:
+			if compact or self.encoder is None:
+				#Objects keep their indices for as long as the same encoder is used, so a new one can only start with a full save
+				self.encoder = _Encoder(g, board)
+			contents = self.encoder.contents(copy)
+			last = self.last
+			self.last = contents
+			if not compact and last is not None:
+				delta = diff_contents(last, contents)
+				if delta is None:
+					return []
+				payload = pack(delta)
+				record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+				self.journal_size += len(record)
+				self.records += 1
+				return [(journal_path(path), record, True)]
+			payload = pack_save(contents)
+			crc = zlib.crc32(payload)
+			self.snapshot_crc = crc
+			self.snapshot_size = len(payload)
+			return [
+				(path, HEADER.pack(MAGIC, VERSION, crc) + payload, False),
+				(journal_path(path), JOURNAL_HEADER.pack(JOURNAL_MAGIC, crc), False)
+			]
+
+	def save(self, g, path):
+		"Takes a snapshot and encodes it straight away"
+		return self.writes(self.snapshot(g), path)
+
+class _PlainUnpickler(pickle.Unpickler):
+	"The data only consists of plain values, so a save should never need to load any class or function"
+
+	def find_class(self, module, name):
+		raise SaveFormatError(f"Save data refers to {module}.{name}")
+
+def is_save_data(data):
+	return data[:len(MAGIC)] == MAGIC
+
+def _unpack(payload, compressed=True):
+	try:
+		if compressed:
+			payload = zlib.decompress(payload)
+		return _PlainUnpickler(io.BytesIO(payload)).load()
+	except (pickle.UnpicklingError, zlib.error, EOFError) as e:
+		raise SaveFormatError(f"Save file is corrupted: {e}") from e
+
+def _unpack_save(payload):
+	contents = _unpack(payload, compressed=False)
+	board = contents["board"]
+	if board.pop("compressed", False):
+		try:
+			for k in GRIDS:
+				board[k] = zlib.decompress(board[k])
+		except zlib.error as e:
+			raise SaveFormatError(f"Save file is corrupted: {e}") from e
+	return contents
+
+def read_journal(journal, crc):
+	"Yields the delta records in a journal, if it belongs to the full save with the given checksum"
+	if len(journal) < JOURNAL_HEADER.size:
+		return
+	magic, snapshot_crc = JOURNAL_HEADER.unpack_from(journal)
+	if magic != JOURNAL_MAGIC or snapshot_crc != crc:
+		return #Left over from before the last compaction
+	pos = JOURNAL_HEADER.size
+	while pos + RECORD_HEADER.size <= len(journal):
+		length, record_crc = RECORD_HEADER.unpack_from(journal, pos)
+		pos += RECORD_HEADER.size
+		payload = journal[pos:pos + length]
+		if len(payload) < length or zlib.crc32(payload) != record_crc:
+			return #The game stopped partway through writing this record; everything up to it is still good
+		pos += length
+		yield _unpack(payload)
+
+def read_save(data, journal=None):
+	"""
+	Checks the header of the save data and returns its contents, migrated to the current version.
+	journal - The contents of the save's journal file, if there is one
+	"""
+	if len(data) < HEADER.size or not is_save_data(data):
+		raise SaveFormatError("Not a save file")
+	magic, version, crc = HEADER.unpack_from(data)
+	payload = data[HEADER.size:]
+	if zlib.crc32(payload) != crc:
+		raise SaveFormatError("Save file is corrupted")
+	if version > VERSION:
+		raise SaveFormatError(f"Save file is from a newer version of the game (format {version})")
+	contents = _unpack_save(payload)
+	if journal:
+		for delta in read_journal(journal, crc):
+			apply_delta(contents, delta)
+	while version < VERSION:
+		contents = MIGRATIONS[version](contents)
+		version += 1
+	return contents
+
+class _Decoder:
+
+	def __init__(self, g, contents):
+		self.g = g
+		self.board = None
+		self.fov = set() #The player's field of view
+		self.types = saved_types()
+		self.tables = {}
+		for table in ("monsters", "items", "objects"):
+			objs = []
+			for name, _ in contents[table]:
+				cls = self.types.get(name)
+				if cls is None:
+					raise SaveFormatError(f"Unknown type in save file: {name}")
+				objs.append(cls.__new__(cls))
+			self.tables[table] = objs
+
+	def fill(self, contents):
+		"Sets the fields of every object. Done after they've all been created, since they can refer to each other."
+		for table, objs in self.tables.items():
+			for obj, (_, fields) in zip(objs, contents[table]):
+				state = {k: v if type(v) in PLAIN else self.value(v) for k, v in fields.items()}
+				setstate = getattr(type(obj), "__setstate__", None)
+				if setstate is not None:
+					setstate(obj, state)
+				else:
+					obj.__dict__.update(state)
+
+	def value(self, v):
+		t = type(v)
+		if t in PLAIN:
+			return v
+		if t is tuple:
+			if v and type(v[0]) is str and v[0][:1] == "\0":
+				tag = v[0]
+				if tag == REF:
+					return self.tables[v[1]][v[2]]
+				if tag == GAME:
+					return self.g
+				if tag == BOARD:
+					return self.board
+				if tag == TYPE:
+					return self.types[v[1]]
+				if tag == DEQUE:
+					return deque(v[1] if _plain(v[1]) else map(self.value, v[1]), v[2])
+				if tag == DEFAULTDICT:
+					return defaultdict(FACTORIES[v[1]], {self.value(k): self.value(x) for k, x in v[2].items()})
+				if tag == TUPLE:
+					return tuple(map(self.value, v[1:]))
+				raise SaveFormatError(f"Unknown tag in save file: {tag!r}")
+			if PLAIN.issuperset(map(type, v)):
+				return v
+			return tuple(map(self.value, v))
+		if t is list:
+			return v[:] if _plain(v) else list(map(self.value, v))
+		if t is set or t is frozenset:
+			return t(v) if _plain(v) else t(map(self.value, v))
+		if t is dict:
+			if _plain(v) and _plain(v.values()):
+				return v.copy()
+			return {self.value(k): self.value(x) for k, x in v.items()}
+		return v
+
+	def make_board(self, data):
+		from board import Board, TERRAIN_BY_NAME
+		cols = data["cols"]
+		rows = data["rows"]
+		terrain = data["terrain"]
+		flags = data["flags"]
+		if len(terrain) != cols * rows or len(flags) != cols * rows:
+			raise SaveFormatError("Board data has the wrong size")
+		codes = bytearray(range(256)) #Palette code -> index in the terrain table
+		for code, name in enumerate(data["palette"]):
+			if name not in TERRAIN_BY_NAME:
+				raise SaveFormatError(f"Unknown terrain in save file: {name}")
+			codes[code] = TERRAIN_BY_NAME[name].index
+		cells = range(cols * rows)
+		walked_cells = set(compress(cells, flags.translate(FLAGS_TO_WALKED)))
+		self.fov = {(index % cols, index // cols) for index in compress(cells, flags.translate(FLAGS_TO_VISIBLE))}
+		board = Board.__new__(Board)
+		board.__setstate__({
+			"g": self.g,
+			"cols": cols,
+			"rows": rows,
+			"terrain": bytearray(terrain.translate(codes)),
+			"items": {index: self.value(v) for index, v in data["items"]},
+			"rooms": [tuple(room) for room in data["rooms"]],
+			"walked": walked_cells,
+			"revealed": bytearray(flags.translate(FLAGS_TO_REVEALED))
+		}) #The packed grids and the monster collision cache are set up from these
+		return board
+
+def decode_game(g, data, journal=None):
+	"Loads save data (as returned by encode_game) into g, replaying the journal on top of it if given"
+	contents = read_save(data, journal)
+	dec = _Decoder(g, contents)
+	#The board has to exist before any object fields are filled in, since they may refer to it
+	dec.board = board = dec.make_board(contents["board"])
+	dec.fill(contents)
+	state = {k: dec.value(v) for k, v in contents["game"].items()}
+	state["board"] = board
+	state["approach_key"] = state["approach"] = None
+	g.__setstate__(state)
+	g.refresh_cache()
+	g.player.fov = dec.fov
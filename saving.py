@@ -0,0 +1,103 @@
+#Background saving
+#Saving happens in two steps: a copy of the game's state is first taken on the game thread, which is consistent since
+#nothing else can change the game while it's taken. The copy is then encoded into bytes and written to disk by a worker
+#thread, so the game waits neither for the encoding nor for the disk. Files are replaced by writing under a temporary name and then renaming, so a crash in the middle of a save never
+#leaves a half-written save file behind.
+#Saves are made up of writes that either replace a file or append to one (see savefile.SaveJournal). If a save that
+#replaces everything comes in while earlier ones are still waiting to be written, the earlier ones are dropped.
+import os, threading, time
+
+def write_atomic(path, data):
+	"Writes data to path, such that the file either has the old contents or the new contents, but never a mix"
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(data)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, path)
+	
+def write_append(path, data):
+	with open(path, "ab") as f:
+		f.write(data)
+		f.flush()
+		os.fsync(f.fileno())
+
+class SaveWriter:
+
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.pending = [] #Saves waiting to be encoded and written, in order
+		self.submitted = None #When the oldest pending save was submitted
+		self.writing = False
+		self.thread = None
+		self.error = None #The last exception raised while writing, if any
+		self.saves = 0 #Number of batches of writes made
+		self.coalesced = 0 #Number of saves dropped because a newer one replaced them
+		self.last_latency = None #Seconds from submitting the last save until it was on disk
+		self.last_size = None #Number of bytes written by the last save
+
+	def submit(self, encode, replaces=False):
+		"""
+		Queues a save. encode is called on the worker thread, and returns the save as a list of (path, data, append) writes.
+		replaces - Whether the save replaces everything saved before, rather than appending to it
+		"""
+		with self.cond:
+			if replaces:
+				if self.pending:
+					self.coalesced += 1
+				self.pending = []
+			if not self.pending:
+				self.submitted = time.perf_counter()
+			self.pending.append(encode)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._run, name="save-writer", daemon=True)
+				self.thread.start()
+			self.cond.notify_all()
+
+	def busy(self):
+		with self.cond:
+			return bool(self.pending) or self.writing
+
+	def flush(self):
+		"Waits until every queued save has been written"
+		with self.cond:
+			while self.pending or self.writing:
+				self.cond.wait()
+
+	def cancel(self):
+		"Drops any queued saves, and waits for one that's being written to finish"
+		with self.cond:
+			self.pending = []
+			while self.writing:
+				self.cond.wait()
+
+	def _run(self):
+		while True:
+			with self.cond:
+				while not self.pending:
+					self.cond.wait()
+				saves = self.pending
+				submitted = self.submitted
+				self.pending = []
+				self.writing = True
+			error = None
+			size = 0
+			try:
+				for encode in saves:
+					for path, data, append in encode():
+						if append:
+							write_append(path, data)
+						else:
+							write_atomic(path, data)
+						size += len(data)
+			except Exception as e:
+				error = e
+			with self.cond:
+				self.writing = False
+				if error is None:
+					self.saves += 1
+					self.last_latency = time.perf_counter() - submitted
+					self.last_size = size
+				else:
+					self.error = error
+				self.cond.notify_all()
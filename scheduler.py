@@ -0,0 +1,135 @@
+#Turn scheduler
+#Every tick, faster monsters act before slower ones, and monsters with the same speed act in a random order.
+#Rather than sorting every monster by speed each tick, monsters are kept in buckets by speed, with the speeds
+#kept in descending order. Adding, removing or changing the speed of a monster only touches its own bucket.
+#
+#Monsters that have nothing to do for a while (e.g. unaware and far from the player) can be parked as dormant.
+#Dormant monsters are taken out of the buckets, so they cost nothing per tick, and are kept in a queue ordered by
+#the tick at which they should wake up. When they wake, the ticks they missed are applied all at once.
+import heapq
+from rng import random
+from bisect import insort
+
+class Scheduler:
+	
+	def __init__(self):
+		self.buckets = {} #speed -> list of monsters
+		self.speeds = [] #Speeds that have a bucket, in ascending order
+		self.slots = {} #monster -> (speed, index in bucket)
+		self.dormant = {} #monster -> (wake tick, tick it was parked)
+		self.wakeups = [] #Heap of (wake tick, sequence number, monster); stale entries are skipped
+		self.seq = 0
+		self.last_fov = None
+	
+	def __len__(self):
+		return len(self.slots) + len(self.dormant)
+	
+	def __contains__(self, m):
+		return m in self.slots or m in self.dormant
+		
+	def active(self):
+		"Returns the monsters that aren't dormant"
+		return list(self.slots)
+	
+	def clear(self):
+		self.buckets.clear()
+		self.speeds.clear()
+		self.slots.clear()
+		self.dormant.clear()
+		self.wakeups.clear()
+		self.last_fov = None
+	
+	def add(self, m):
+		if m in self.slots:
+			return
+		speed = m.get_speed()
+		bucket = self.buckets.get(speed)
+		if bucket is None:
+			bucket = self.buckets[speed] = []
+			insort(self.speeds, speed)
+		self.slots[m] = (speed, len(bucket))
+		bucket.append(m)
+	
+	def remove(self, m):
+		self.dormant.pop(m, None)
+		slot = self.slots.pop(m, None)
+		if slot is None:
+			return
+		speed, index = slot
+		bucket = self.buckets[speed]
+		last = bucket.pop()
+		if last is not m: #Move the last monster into the freed slot
+			bucket[index] = last
+			self.slots[last] = (speed, index)
+		if not bucket:
+			del self.buckets[speed]
+			self.speeds.remove(speed)
+	
+	def update(self, m):
+		"Must be called when a monster's speed may have changed"
+		slot = self.slots.get(m)
+		if slot is not None and slot[0] != m.get_speed():
+			self.remove(m)
+			self.add(m)
+	
+	def turn_order(self):
+		"Returns the order in which monsters act this tick"
+		buckets = self.buckets
+		speeds = self.speeds
+		shuffle = random.shuffle
+		if len(speeds) == 1:
+			order = buckets[speeds[0]][:]
+			shuffle(order)
+			return order
+		order = []
+		for speed in reversed(speeds):
+			group = buckets[speed]
+			if len(group) > 1:
+				group = group[:]
+				shuffle(group)
+			order += group
+		return order
+
+	
+	def park(self, m, wake_tick, tick):
+		"Makes a monster dormant until wake_tick. tick is the current tick."
+		if m not in self.slots:
+			return
+		self.remove(m)
+		self.dormant[m] = (wake_tick, tick)
+		self.seq += 1
+		heapq.heappush(self.wakeups, (wake_tick, self.seq, m))
+		
+	def wake(self, m, tick):
+		"Makes a dormant monster active again, in time to act on the given tick"
+		entry = self.dormant.pop(m, None)
+		if entry is None:
+			return
+		m.catch_up(tick - 1 - entry[1])
+		if m.HP > 0:
+			self.add(m)
+			
+	def wake_due(self, tick):
+		"Wakes every monster whose wake-up time has come"
+		wakeups = self.wakeups
+		while wakeups and wakeups[0][0] <= tick:
+			wake_tick, _, m = heapq.heappop(wakeups)
+			entry = self.dormant.get(m)
+			if entry is not None and entry[0] == wake_tick:
+				self.wake(m, tick)
+				
+	def wake_visible(self, fov, board, tick):
+		"Wakes every dormant monster inside the given field of view. Only does any work when the field of view has changed."
+		if fov is self.last_fov or not self.dormant:
+			return
+		self.last_fov = fov
+		if len(self.dormant) <= len(fov):
+			woken = [m for m in self.dormant if (m.x, m.y) in fov]
+		else:
+			woken = []
+			for x, y in fov:
+				m = board.get_mon_cache(x, y)
+				if m is not None and m in self.dormant:
+					woken.append(m)
+		for m in woken:
+			self.wake(m, tick)
@@ -0,0 +1,26 @@
+import os, sys
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gameobj import Game
+
+@pytest.fixture
+def make_game(tmp_path):
+	"Returns a function that makes a headless game and plays it for a number of turns, with the player wandering around"
+	def make_game(seed=0, turns=0, board_size=None):
+		random.seed(seed)
+		kwargs = {"board_size": board_size} if board_size else {}
+		g = Game(headless=True, seed=seed, save_path=str(tmp_path / "save.dat"), **kwargs)
+		g.generate_level()
+		g.player.HP = 10**6 #So that the game doesn't end partway through
+		for _ in range(turns):
+			wander(g)
+		return g
+	return make_game
+
+def wander(g):
+	"Plays one turn of the player moving in a random direction"
+	g.player.move(*random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)]))
+	g.do_turn()
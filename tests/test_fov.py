@@ -0,0 +1,26 @@
+import random
+from fov import shadowcast
+
+def floor_cells(board):
+	return [(x, y) for y in range(board.rows) for x in range(board.cols) if not board.blocks_sight(x, y)]
+
+def test_shadowcast_is_symmetric(make_game):
+	for seed in range(5):
+		board = make_game(seed).board
+		cells = floor_cells(board)
+		random.seed(seed)
+		viewers = random.sample(cells, 20)
+		fovs = {cell: shadowcast(board, *cell) for cell in viewers}
+		for a in viewers:
+			for b in viewers:
+				assert (b in fovs[a]) == (a in fovs[b]), (seed, a, b)
+
+def test_shadowcast_sees_neighbours(make_game):
+	board = make_game(1).board
+	for x, y in floor_cells(board)[:50]:
+		fov = shadowcast(board, x, y)
+		assert (x, y) in fov
+		for dx in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				if 0 <= x + dx < board.cols and 0 <= y + dy < board.rows:
+					assert (x + dx, y + dy) in fov
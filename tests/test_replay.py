@@ -0,0 +1,40 @@
+import random
+from gameobj import Game
+from headless import ScriptExhausted
+from replay import replay, start_game, start_recording, state_digest
+from roguelike import play
+
+def record(tmp_path, seed, keys, loaded_from=None):
+	"Plays a game from a script of keys while recording it, and returns the path of the recording and the final digest"
+	path = str(tmp_path / f"game{seed}.rec")
+	g = Game(headless=True, keys=keys, seed=seed, save_path=str(tmp_path / f"game{seed}.dat"), board_size=(60, 30))
+	start_game(g, loaded_from or b"")
+	recorder = start_recording(g, path, loaded=loaded_from is not None)
+	try:
+		play(g)
+	except ScriptExhausted:
+		pass
+	recorder.close()
+	g.saver.flush()
+	g.delete_saved_game()
+	return path, state_digest(g), g.player.ticks
+
+def script(seed, length=1500):
+	random.seed(seed)
+	return [random.choice("wasd" * 6 + "r.p fn") for _ in range(length)]
+
+def test_replay_matches_recording(tmp_path):
+	for seed in range(3):
+		path, digest, ticks = record(tmp_path, seed, script(seed))
+		result = replay(path)
+		assert result["divergences"] == 0
+		assert result["turns"] == ticks
+		assert result["digest"] == digest
+
+def test_replay_from_loaded_game(tmp_path, make_game):
+	from savefile import encode_game
+	start_state = encode_game(make_game(5, turns=100, board_size=(60, 30)))
+	path, digest, ticks = record(tmp_path, 5, script(5), loaded_from=start_state)
+	result = replay(path)
+	assert result["divergences"] == 0
+	assert result["digest"] == digest
@@ -0,0 +1,19 @@
+from rng import Stream, words_between, advance_state, MAX_ADVANCE
+
+def test_words_between():
+	s = Stream("test")
+	old = s.pack_state()
+	for draw in (lambda: None, s.random, lambda: s.randint(1, 6), lambda: s.getrandbits(100), lambda: [s.random() for _ in range(700)]):
+		draw()
+		new = s.pack_state()
+		words = words_between(old, new)
+		assert words is not None
+		assert advance_state(old, words) == new
+		old = new
+
+def test_words_between_unrelated():
+	old = Stream("a").pack_state()
+	s = Stream("a")
+	s.getrandbits(32 * (MAX_ADVANCE + 1))
+	assert words_between(old, s.pack_state()) is None
+	assert words_between(old, Stream("b").pack_state()) is None
@@ -0,0 +1,79 @@
+import os
+import pytest
+from conftest import wander
+from gameobj import Game
+from savefile import (encode_game, decode_game, read_save, diff_contents, apply_delta, journal_path, SaveFormatError,
+	_Encoder, HEADER, JOURNAL_HEADER)
+
+def test_round_trip(make_game):
+	for seed in range(3):
+		g = make_game(seed, turns=200)
+		data = encode_game(g)
+		loaded = Game(headless=True)
+		decode_game(loaded, data)
+		assert _Encoder(loaded).contents() == _Encoder(g).contents()
+		assert loaded.player.fov == g.player.fov
+		assert loaded.board.terrain == g.board.terrain
+		assert loaded.board.revealed == g.board.revealed
+		assert [(type(m), m.x, m.y, m.HP) for m in loaded.monsters] == [(type(m), m.x, m.y, m.HP) for m in g.monsters]
+
+def test_round_trip_big_board(make_game):
+	#Boards this big have their grids compressed
+	g = make_game(turns=20, board_size=(100, 60))
+	loaded = Game(headless=True)
+	decode_game(loaded, encode_game(g))
+	assert _Encoder(loaded).contents() == _Encoder(g).contents()
+
+def test_corrupted(make_game):
+	data = bytearray(encode_game(make_game()))
+	data[-1] ^= 1
+	with pytest.raises(SaveFormatError):
+		read_save(bytes(data))
+	with pytest.raises(SaveFormatError):
+		read_save(b"not a save")
+
+def test_newer_version(make_game):
+	data = bytearray(encode_game(make_game()))
+	magic, version, crc = HEADER.unpack_from(data)
+	HEADER.pack_into(data, 0, magic, version + 1, crc)
+	with pytest.raises(SaveFormatError):
+		read_save(bytes(data))
+
+def test_journal_round_trip(make_game):
+	g = make_game(turns=50)
+	for turn in range(300):
+		wander(g)
+		if turn % 3 == 0:
+			g.save_game(wait=True)
+		if turn % 50 == 49:
+			g.save_game(wait=True)
+			loaded = Game(headless=True, save_path=g.save_path)
+			loaded.load_game()
+			assert _Encoder(loaded).contents() == _Encoder(g).contents()
+	assert os.path.getsize(journal_path(g.save_path)) > JOURNAL_HEADER.size #Some of those saves were journal records
+
+def test_torn_journal_record(make_game):
+	g = make_game()
+	g.save_game(wait=True)
+	before = _Encoder(g).contents()
+	wander(g)
+	g.save_game(wait=True)
+	with open(journal_path(g.save_path), "r+b") as f:
+		f.truncate(os.path.getsize(journal_path(g.save_path)) - 1)
+	loaded = Game(headless=True, save_path=g.save_path)
+	loaded.load_game()
+	assert _Encoder(loaded).contents() == before
+
+def test_grid_delta(make_game):
+	g = make_game()
+	old = _Encoder(g).contents()
+	board = g.board
+	hidden = [(x, y) for y in range(board.rows) for x in range(board.cols) if not board.revealed[x + y * board.cols]]
+	for x, y in (hidden[0], hidden[-1]):
+		board.reveal(x, y)
+	new = _Encoder(g).contents()
+	delta = diff_contents(old, new)
+	assert "flags" not in delta.get("board", {})
+	assert len(delta["grids"]["flags"]) == 2 #One run for each row that changed, rather than the whole grid
+	apply_delta(old, delta)
+	assert old == new
@@ -1,4 +1,5 @@
-import random, math
+import math
+from rng import random
 
 def dice(num, sides):
 	"Rolls a given number of dice with a given number of dice and takes the sum"